@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+'''Benchmarks the redaction and logging pipeline
+
+Runs offline: messages are synthetic and handlers write to memory.
+Results are saved as JSON and can be compared with a previous run:
+
+    ./benchmark.py -o new.json --compare old.json
+'''
+import argparse
+import io
+import json
+import logging
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from encrypt_password import (are_valid, hash_password, hash_passwords,
+                              is_valid)
+from filtered_logger import (PII_FIELDS, RedactingFormatter, _redactor,
+                             filter_data_batch, filter_datum, get_logger)
+
+
+Case = Tuple[str, Dict, Callable[[], object]]
+
+
+def make_message(segments: int, fields: int, value_len: int = 16,
+                 separator: str = ';') -> str:
+    '''Builds a message of key=value segments, fields of them sensitive
+
+    Raises ValueError when fields does not fit in segments.
+    '''
+    if fields > segments:
+        raise ValueError('{} fields do not fit in {} segments'.format(
+            fields, segments))
+    keys = list(PII_FIELDS[:fields])
+    keys += ['key{}'.format(i) for i in range(segments - len(keys))]
+    value = 'v' * value_len
+    return ''.join('{}={}{}'.format(k, value, separator) for k in keys)
+
+
+def legacy_filter_datum(fields: List[str], redaction: str,
+                        message: str, separator: str) -> str:
+    '''filter_datum as first written, one re.sub per field and segment'''
+    m = message.split(separator)
+    for i in fields:
+        m = [re.sub(i + '=.*', i + '=' + redaction, j) for j in m]
+    return separator.join(m)
+
+
+def check_compatibility(count: int = 2000, seed: int = 0) -> List[str]:
+    '''Returns the messages that the redaction functions do not redact
+    like legacy_filter_datum, for PII_FIELDS and the ';' separator
+
+    Messages are random mixes of the field names, separators, '=', line
+    breaks and other text. The pattern is also checked in its prefix
+    trie form.
+    '''
+    rnd = random.Random(seed)
+    atoms = list(PII_FIELDS) + [';', ';', '=', '=', '\n', ' ', 'x', 'é',
+                                'na', 'ssn=', 'mail', '***']
+    messages = [''.join(rnd.choice(atoms) for _ in range(rnd.randrange(12)))
+                for _ in range(count)]
+    messages += [make_message(8, 5), 'name=a;xname=b;name=c=d;name=',
+                 'email=1name=2;;phone', 'password=\nssn=1;']
+    trie = _redactor(PII_FIELDS, '***', ';', 1)
+    single = [m for m in messages if '\n' not in m]
+    batch = dict(zip(single, filter_data_batch(PII_FIELDS, '***', single,
+                                               ';')))
+    failures = []
+    for message in messages:
+        expected = legacy_filter_datum(PII_FIELDS, '***', message, ';')
+        if filter_datum(PII_FIELDS, '***', message, ';') != expected or \
+                trie(message) != expected or \
+                batch.get(message, expected) != expected:
+            failures.append(message)
+    return failures
+
+
+def measure(func: Callable[[], object], repeat: int = 30,
+            number: int = 200) -> Dict[str, float]:
+    '''Times func and returns ops/sec, latency percentiles and allocations
+
+    Latencies are per call, averaged over number calls per sample.
+    Allocations are the peak traced bytes and the blocks still held
+    after a single call.
+    '''
+    func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter_ns() - start) / number)
+    centiles = statistics.quantiles(samples, n=100)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.reset_peak()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    held = len(tracemalloc.take_snapshot().traces) - blocks
+    tracemalloc.stop()
+
+    return {'ops_per_sec': 1e9 / statistics.mean(samples),
+            'p50_ns': centiles[49],
+            'p90_ns': centiles[89],
+            'p99_ns': centiles[98],
+            'alloc_peak_bytes': peak - before,
+            'alloc_held_blocks': held}
+
+
+def redaction_cases(quick: bool) -> Iterator[Case]:
+    '''filter_datum across message length, fields and segments'''
+    for segments in ((8,) if quick else (4, 8, 32, 128)):
+        for fields in ((5,) if quick else (1, 3, 5)):
+            if fields > segments:
+                continue
+            keys = PII_FIELDS[:fields]
+            for value_len in ((16,) if quick else (8, 64, 512)):
+                message = make_message(segments, fields, value_len)
+                params = {'segments': segments, 'fields': fields,
+                          'length': len(message)}
+                yield ('filter_datum', params,
+                       lambda k=keys, m=message: filter_datum(k, '***',
+                                                              m, ';'))
+
+
+def batch_cases(quick: bool) -> Iterator[Case]:
+    '''filter_datum per message against filter_data_batch'''
+    for size in ((100,) if quick else (10, 100, 1000)):
+        messages = [make_message(8, 5) for _ in range(size)]
+        params = {'messages': size}
+        yield ('filter_datum', params,
+               lambda ms=messages: [filter_datum(PII_FIELDS, '***', m, ';')
+                                    for m in ms])
+        yield ('filter_data_batch', params,
+               lambda ms=messages: filter_data_batch(PII_FIELDS, '***',
+                                                     ms, ';'))
+
+
+def formatter_cases(quick: bool) -> Iterator[Case]:
+    '''RedactingFormatter.format across message length'''
+    formatter = RedactingFormatter(PII_FIELDS)
+    for segments in ((8,) if quick else (4, 8, 32, 128)):
+        message = make_message(segments, min(segments, len(PII_FIELDS)))
+        record = logging.LogRecord('user_data', logging.INFO, __file__, 0,
+                                   message, None, None)
+        params = {'segments': segments, 'length': len(message)}
+        yield ('RedactingFormatter.format', params,
+               lambda r=record: formatter.format(r))
+        payload = dict(s.split('=', 1) for s in message.split(';') if s)
+        record = logging.LogRecord('user_data', logging.INFO, __file__, 0,
+                                   payload, None, None)
+        yield ('RedactingFormatter.format', dict(params, payload='mapping'),
+               lambda r=record: formatter.format(r))
+
+
+def logger_cases(quick: bool) -> Iterator[Case]:
+    '''get_logger().info end to end, per handler type'''
+    message = make_message(8, 5)
+    for handler in ('stream', 'queued', 'batched'):
+        logger = get_logger(queued=handler == 'queued', overflow='drop',
+                            batched=handler == 'batched')
+        logger.handlers[0].stream = io.StringIO()
+        yield ('get_logger.info', {'handler': handler},
+               lambda lg=logger: lg.info(message))
+        for h in logger.handlers:
+            h.close()
+
+
+def wide_fields(count: int) -> List[str]:
+    '''Builds count sensitive keys sharing prefixes, like real configs'''
+    prefixes = ('customer', 'billing', 'shipping', 'account', 'contact',
+                'payment', 'employee', 'patient', 'member', 'device')
+    return ['{}_{}{}'.format(prefixes[i % len(prefixes)], PII_FIELDS[i % 5],
+                             i // len(prefixes)) for i in range(count)]
+
+
+def field_count_cases(quick: bool) -> Iterator[Case]:
+    '''Flat alternation against the prefix trie as the field set grows'''
+    for count in ((5, 500) if quick else (5, 50, 500)):
+        fields = tuple(wide_fields(count))
+        keys = list(fields[::max(1, count // 8)][:8])
+        keys += ['other{}'.format(i) for i in range(8)]
+        message = ''.join('{}=vvvvvvvvvvvvvvvv;'.format(k) for k in keys)
+        for path, threshold in (('regex', count + 1), ('trie', 0)):
+            redact = _redactor(fields, '***', ';', threshold)
+            yield ('filter_datum', {'fields': count, 'path': path},
+                   lambda r=redact, m=message: r(m))
+
+
+def password_cases(quick: bool) -> Iterator[Case]:
+    '''Serial bcrypt calls against the pooled batch variants'''
+    passwords = ['password{}'.format(i) for i in range(4 if quick else 16)]
+    hashes = [hash_password(p) for p in passwords]
+    pairs = list(zip(hashes, passwords))
+    params = {'passwords': len(passwords)}
+    yield ('hash_password', dict(params, mode='serial'),
+           lambda: [hash_password(p) for p in passwords])
+    yield ('is_valid', dict(params, mode='serial'),
+           lambda: [is_valid(h, p) for h, p in pairs])
+    for mode in ('threads', 'processes'):
+        processes = mode == 'processes'
+        yield ('hash_passwords', dict(params, mode=mode),
+               lambda pr=processes: hash_passwords(passwords, processes=pr))
+        yield ('are_valid', dict(params, mode=mode),
+               lambda pr=processes: are_valid(pairs, processes=pr))
+
+
+SUITES = {
+    'redaction': redaction_cases,
+    'fields': field_count_cases,
+    'batch': batch_cases,
+    'formatter': formatter_cases,
+    'logger': logger_cases,
+    'passwords': password_cases,
+}
+# bcrypt is slow by design, a handful of batches is enough to time it
+TIMING = {'passwords': (3, 1)}
+
+
+def run(suites: List[str], quick: bool = False) -> Dict:
+    '''Runs the selected suites and returns their results'''
+    results = []
+    for suite in suites:
+        for name, params, func in SUITES[suite](quick):
+            result = {'suite': suite, 'name': name, 'params': params}
+            timing = TIMING.get(suite, (5, 50) if quick else (30, 200))
+            result.update(measure(func, *timing))
+            results.append(result)
+            print('{:<28} {:<48} {:>12.1f} ops/s  p99 {:>9.0f} ns'.format(
+                name, json.dumps(params), result['ops_per_sec'],
+                result['p99_ns']), file=sys.stderr)
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.utcnow().isoformat(),
+            'results': results}
+
+
+def compare(old: Dict, new: Dict) -> None:
+    '''Prints the throughput ratio of every case present in both runs'''
+    def key(result):
+        return result['name'], json.dumps(result['params'], sort_keys=True)
+    previous = {key(r): r for r in old['results']}
+    for result in new['results']:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        ratio = result['ops_per_sec'] / before['ops_per_sec']
+        print('{:<28} {:<48} x{:.2f}'.format(*key(result), ratio))
+
+
+def main(argv: List[str] = None) -> None:
+    '''Main function'''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('suites', nargs='*',
+                        help='suites to run among {}, all by default'.format(
+                            ', '.join(SUITES)))
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('--compare', help='previous results to compare with')
+    parser.add_argument('--quick', action='store_true',
+                        help='run a reduced matrix')
+    args = parser.parse_args(argv)
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite: {}'.format(suite))
+    failures = check_compatibility()
+    if failures:
+        parser.exit(1, 'redaction differs from filter_datum as first '
+                    'written on: {!r}\n'.format(failures[:5]))
+    results = run(args.suites or list(SUITES), args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+'''Pooled database connections'''
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Callable, Dict
+
+
+def sqlite_connect(database: str) -> sqlite3.Connection:
+    '''Opens an sqlite3 connection that can move between threads'''
+    return sqlite3.connect(database, check_same_thread=False)
+
+
+def ping(db) -> bool:
+    '''Checks that a connection still answers'''
+    if hasattr(db, 'is_connected'):
+        return db.is_connected()
+    try:
+        cursor = db.cursor()
+        cursor.execute("SELECT 1;")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class _Cursor(sqlite3.Cursor):
+    '''sqlite3 cursor that can hold a reference to its PooledConnection'''
+
+
+class PooledConnection():
+    '''Connection borrowed from a ConnectionPool
+
+    Behaves like the connection it wraps, except that close() hands it
+    back to the pool. A connection dropped without close() goes back
+    once neither it nor one of its cursors is referenced any more.
+    '''
+
+    def __init__(self, pool: 'ConnectionPool', raw):
+        '''Initialize the wrapper'''
+        self._pool = pool
+        self.raw = raw
+        self._finalizer = weakref.finalize(self, pool.release, raw)
+        self._finalizer.atexit = False
+
+    def __getattr__(self, name: str):
+        '''Delegates to the wrapped connection'''
+        if self.raw is None:
+            raise AttributeError('connection already closed')
+        return getattr(self.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        '''Opens a cursor that keeps the connection borrowed while used'''
+        if self.raw is None:
+            raise AttributeError('connection already closed')
+        if isinstance(self.raw, sqlite3.Connection) and not args:
+            kwargs.setdefault('factory', _Cursor)
+        cursor = self.raw.cursor(*args, **kwargs)
+        try:
+            cursor.pooled_connection = self
+        except AttributeError:
+            pass
+        return cursor
+
+    def close(self) -> None:
+        '''Returns the connection to its pool'''
+        if self.raw is not None:
+            self.raw = None
+            self._finalizer()
+
+    def __enter__(self) -> 'PooledConnection':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ConnectionPool():
+    '''Keeps up to size connections open for reuse
+
+    Idle connections older than idle_timeout seconds are closed on
+    acquire, and the ones idle for more than check_after seconds are
+    pinged before being handed out. Open transactions are rolled back
+    when a connection comes back. A forked child starts an empty pool
+    instead of sharing its parent's sockets.
+    '''
+
+    def __init__(self, connect: Callable, size: int = 5,
+                 idle_timeout: float = 300.0, check_after: float = 30.0,
+                 health_check: Callable = ping):
+        '''Initialize pool'''
+        if size < 1:
+            raise ValueError('pool size must be positive')
+        self.connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.health_check = health_check
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'waits': 0,
+                      'overflows': 0}
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self) -> None:
+        '''Forgets every connection, used at creation and after a fork'''
+        self._pid = os.getpid()
+        self._idle = deque()
+        self._open = 0
+
+    def _discard(self, raw) -> None:
+        '''Closes a connection that is not coming back'''
+        self.stats['discarded'] += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: float = None, overflow: bool = False):
+        '''Borrows a connection, waiting up to timeout when all are busy
+
+        With overflow, a connection of its own is opened instead of
+        waiting, outside the pool: closing it closes it.
+        '''
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            while True:
+                while self._idle:
+                    raw, since = self._idle.pop()
+                    idle = time.monotonic() - since
+                    if idle > self.idle_timeout or (
+                            idle > self.check_after and
+                            not self.health_check(raw)):
+                        self._open -= 1
+                        self._discard(raw)
+                        continue
+                    self.stats['reused'] += 1
+                    return PooledConnection(self, raw)
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                if overflow:
+                    self.stats['overflows'] += 1
+                    return self.connect()
+                self.stats['waits'] += 1
+                if not self._cond.wait(timeout):
+                    raise TimeoutError('no connection available')
+        try:
+            raw = self.connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats['created'] += 1
+        return PooledConnection(self, raw)
+
+    def release(self, raw) -> None:
+        '''Takes a connection back'''
+        try:
+            raw.rollback()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._discard(raw)
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def close(self) -> None:
+        '''Closes the idle connections'''
+        with self._cond:
+            while self._idle:
+                raw, _ = self._idle.pop()
+                self._open -= 1
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+
+    def statistics(self) -> Dict[str, int]:
+        '''Returns the reuse counters along with the pool occupancy'''
+        with self._cond:
+            return dict(self.stats, open=self._open, idle=len(self._idle))
+
+
+def placeholder(db) -> str:
+    '''Returns the query parameter marker of a connection's driver'''
+    raw = getattr(db, 'raw', db)
+    return '?' if isinstance(raw, sqlite3.Connection) else '%s'
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 '''Password encrypter'''
 import bcrypt
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple
 
 
 def hash_password(password: str) -> bytes:
@@ -11,3 +15,48 @@ def hash_password(password: str) -> bytes:
 def is_valid(hashed_password: bytes, password: str) -> bool:
     '''Checks if a password is valid'''
     return bcrypt.checkpw(bytes(password, 'utf-8'), hashed_password)
+
+
+def _ordered_map(func: Callable, args: Iterable[tuple], workers: int = None,
+                 processes: bool = False) -> Iterator:
+    '''Calls func on every argument tuple in a pool, in input order
+
+    At most twice as many calls as workers are in flight, so results
+    stream out of arbitrarily large inputs. bcrypt releases the GIL,
+    so threads already use every core.
+    '''
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(workers) as executor:
+        pending = deque()
+        for arg in args:
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, *arg))
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_hash_passwords(passwords: Iterable[str], workers: int = None,
+                        processes: bool = False) -> Iterator[bytes]:
+    '''Hashes passwords in a pool, yielding the hashes in input order'''
+    return _ordered_map(hash_password, ((p,) for p in passwords),
+                        workers, processes)
+
+
+def hash_passwords(passwords: Iterable[str], workers: int = None,
+                   processes: bool = False) -> List[bytes]:
+    '''Hashes passwords in a pool and returns the hashes in input order'''
+    return list(iter_hash_passwords(passwords, workers, processes))
+
+
+def iter_are_valid(pairs: Iterable[Tuple[bytes, str]], workers: int = None,
+                   processes: bool = False) -> Iterator[bool]:
+    '''Checks (hashed_password, password) pairs in a pool, in input order'''
+    return _ordered_map(is_valid, pairs, workers, processes)
+
+
+def are_valid(pairs: Iterable[Tuple[bytes, str]], workers: int = None,
+              processes: bool = False) -> List[bool]:
+    '''Checks (hashed_password, password) pairs and returns the results'''
+    return list(iter_are_valid(pairs, workers, processes))
@@ -1,22 +1,117 @@
 #!/usr/bin/env python3
 '''Filters out sensitive data'''
+import argparse
+import io
+import json
+import os
 import re
 import logging
+import logging.handlers
+import queue
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from db_pool import ConnectionPool, placeholder, sqlite_connect
+from functools import lru_cache, partial
+from itertools import islice
 from mysql.connector import connection, connect
 from os import getenv
-from typing import List, Union
+from typing import (Callable, Dict, Iterable, List, Mapping, Sequence,
+                    TextIO, Tuple, Union)
 
 
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
 
+# field sets at least this large are matched through a prefix trie
+TRIE_MIN_FIELDS = 16
+
+
+def _trie_pattern(keys: Iterable[str]) -> str:
+    '''Builds a pattern matching any of keys, factored on shared prefixes
+
+    The regex engine then walks the alternation like an automaton, one
+    character per level, instead of trying every key in turn.
+    '''
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def walk(node: Dict) -> str:
+        branches = [re.escape(char) + walk(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if '' in node:
+            return '(?:{})?'.format('|'.join(branches))
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:{})'.format('|'.join(branches))
+    return walk(trie)
+
+
+@lru_cache(maxsize=128)
+def _redactor(fields: Tuple[str, ...], redaction: str, separator: str,
+              trie_min_fields: int = TRIE_MIN_FIELDS) -> Callable[[str], str]:
+    '''Builds a single-pass redaction function for a set of fields
+
+    A field value runs up to the next separator or line break, so one
+    compiled alternation of all the fields redacts a whole message in a
+    single scan. Fields are matched as literal keys, through a prefix
+    trie once there are trie_min_fields of them.
+
+    The output is the one of splitting the message on separator and
+    redacting each segment, except with a separator of several
+    characters that a field name overlaps: with fields ('x',) and
+    separator 'xx', 'naxx=a' becomes 'naxx=***', where no segment
+    holds 'x='. benchmark.py checks the single-character case.
+    '''
+    if separator == '':
+        raise ValueError('empty separator')
+    if not fields:
+        return lambda message: message
+    if len(separator) == 1:
+        value = '[^{}\n]*'.format(re.escape(separator))
+    else:
+        value = '(?:(?!{}).)*'.format(re.escape(separator))
+    keys = set(fields)
+    if len(keys) >= trie_min_fields:
+        alternation = _trie_pattern(keys)
+    else:
+        # longest first so a key is never cut short by one of its prefixes
+        keys = sorted(keys, key=len, reverse=True)
+        alternation = '|'.join(map(re.escape, keys))
+    pattern = re.compile('({})={}'.format(alternation, value))
+    replacements = {k: k + '=' + redaction for k in keys}
+    return partial(pattern.sub, lambda m: replacements[m.group(1)])
+
+
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
     '''returns the log message obfuscated'''
-    m = message.split(separator)
-    for i in fields:
-        m = [re.sub(i + '=.*', i + '=' + redaction, j) for j in m]
-    return separator.join(m)
+    return _redactor(tuple(fields), redaction, separator,
+                     TRIE_MIN_FIELDS)(message)
+
+
+def filter_data_batch(fields: List[str], redaction: str,
+                      messages: Iterable[str], separator: str) -> List[str]:
+    '''returns the log messages obfuscated
+
+    The messages are joined on line breaks, which no redaction crosses,
+    and redacted in a single pass over the joined buffer. A batch with
+    line breaks inside its messages is redacted one message at a time.
+    '''
+    redact = _redactor(tuple(fields), redaction, separator, TRIE_MIN_FIELDS)
+    messages = list(messages)
+    joined = '\n'.join(messages)
+    if '\n' in separator or joined.count('\n') != len(messages) - 1:
+        return [redact(m) for m in messages]
+    return redact(joined).split('\n')
 
 
 class RedactingFormatter(logging.Formatter):
@@ -27,55 +122,586 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], json_lines: bool = False):
         '''Initialize formatter'''
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.json_lines = json_lines
+        self._sensitive = frozenset(fields)
+        self._redact = _redactor(tuple(fields), self.REDACTION,
+                                 self.SEPARATOR, TRIE_MIN_FIELDS)
+
+    def redact_mapping(self, payload: Mapping) -> Dict:
+        '''Returns a copy of payload with its sensitive keys redacted'''
+        sensitive = self._sensitive
+        return {k: self.REDACTION if k in sensitive else v
+                for k, v in payload.items()}
 
     def format(self, record: logging.LogRecord) -> str:
-        '''Formats a string while redacting sensitive information'''
+        '''Formats a string while redacting sensitive information
+
+        A record whose msg is a mapping is redacted by key before it is
+        rendered, without any pattern matching.
+        '''
+        if self.json_lines:
+            return self._format_json(record)
+        if isinstance(record.msg, Mapping):
+            return self._format_mapping(record)
         message = super(RedactingFormatter, self).format(record)
-        message = filter_datum(self.fields, self.REDACTION,
-                               message, self.SEPARATOR)
-        message = '; '.join(message.split(';'))
+        return self._redact(message).replace(';', '; ')
+
+    def _exc_text(self, record: logging.LogRecord) -> str:
+        '''Returns the redacted exception and stack text of a record'''
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        text = [record.exc_text or '']
+        if record.stack_info:
+            text.append(self.formatStack(record.stack_info))
+        return self._redact('\n'.join(filter(None, text)))
+
+    def _format_mapping(self, record: logging.LogRecord) -> str:
+        '''Renders a mapping payload as key=value; pairs'''
+        payload = self.redact_mapping(record.msg)
+        record.message = ''.join('{}={}; '.format(k, v)
+                                 for k, v in payload.items())
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        message = self.formatMessage(record)
+        exc_text = self._exc_text(record)
+        if exc_text:
+            message = message + '\n' + exc_text
         return message
 
+    def _format_json(self, record: logging.LogRecord) -> str:
+        '''Renders a record as one line of JSON'''
+        if isinstance(record.msg, Mapping):
+            message = self.redact_mapping(record.msg)
+        else:
+            message = self._redact(record.getMessage())
+        line = {'name': record.name,
+                'level': record.levelname,
+                'asctime': self.formatTime(record, self.datefmt),
+                'message': message}
+        exc_text = self._exc_text(record)
+        if exc_text:
+            line['exc_info'] = exc_text
+        return json.dumps(line, default=str)
+
+    def format_batch(self, records: Iterable[logging.LogRecord]) -> str:
+        '''Formats several records into newline separated lines
+
+        Redaction never crosses a line break, so the whole batch of
+        text records is redacted in one pass over the joined text.
+        '''
+        records = list(records)
+        if self.json_lines or any(isinstance(r.msg, Mapping)
+                                  for r in records):
+            return '\n'.join(map(self.format, records))
+        fmt = super(RedactingFormatter, self).format
+        message = '\n'.join(map(fmt, records))
+        return self._redact(message).replace(';', '; ')
+
+
+def _write_records(handler: logging.Handler,
+                   records: List[logging.LogRecord]) -> None:
+    '''Formats records with the handler and writes them in one call'''
+    try:
+        if isinstance(handler.formatter, RedactingFormatter):
+            text = handler.formatter.format_batch(records)
+        else:
+            text = '\n'.join(map(handler.format, records))
+        handler.stream.write(text + '\n')
+        handler.stream.flush()
+    except Exception:
+        handler.handleError(records[0])
 
-def get_logger() -> logging.Logger:
-    '''Creates a logger'''
+
+class BatchHandler(logging.handlers.BufferingHandler):
+    """ Handler that formats and writes records in batches
+
+    Records are buffered until capacity of them are waiting, or one at
+    flush_level or above arrives, then the whole buffer is formatted,
+    redacted and written with a single call.
+    """
+
+    def __init__(self, stream: TextIO = None, capacity: int = 1000,
+                 flush_level: int = logging.ERROR):
+        '''Initialize handler'''
+        super(BatchHandler, self).__init__(capacity)
+        self.stream = sys.stderr if stream is None else stream
+        self.flush_level = flush_level
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        '''Flushes on a full buffer or a record at flush_level'''
+        return (len(self.buffer) >= self.capacity or
+                record.levelno >= self.flush_level)
+
+    def flush(self) -> None:
+        '''Writes the buffered records'''
+        with self.lock:
+            if self.buffer:
+                records, self.buffer = self.buffer, []
+                _write_records(self, records)
+
+
+class QueueHandler(logging.Handler):
+    """ Handler that formats and writes records on a background thread
+
+    Records go onto a bounded queue and a listener thread formats,
+    redacts and writes them in batches, so the logging thread never
+    waits on the stream. When the queue is full the overflow policy
+    decides: 'block' waits for room, 'drop-oldest' discards the oldest
+    queued record and 'drop' discards the new one. Discarded records
+    are counted in dropped.
+    """
+
+    OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop')
+
+    def __init__(self, stream: TextIO = None, maxsize: int = 10000,
+                 overflow: str = 'block', batch_size: int = 256):
+        '''Initialize handler and start its listener thread'''
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy: {}'.format(overflow))
+        super(QueueHandler, self).__init__()
+        self.stream = sys.stderr if stream is None else stream
+        self.queue = queue.Queue(maxsize)
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._listener = threading.Thread(target=self._listen,
+                                          name='user_data-listener',
+                                          daemon=True)
+        self._listener.start()
+
+    @property
+    def queue_depth(self) -> int:
+        '''Number of records waiting to be written'''
+        return self.queue.qsize()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        '''Queues a record according to the overflow policy'''
+        # Handler.handle serializes emit, so the counter needs no lock
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == 'drop':
+                    self.dropped += 1
+                    return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def _listen(self) -> None:
+        '''Drains the queue until the stop sentinel shows up'''
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        '''Formats a batch of records and writes it in one call'''
+        _write_records(self, batch)
+
+    def close(self) -> None:
+        '''Writes the queued records and stops the listener'''
+        if self._listener.is_alive():
+            self.queue.put(None)
+            self._listener.join()
+        super(QueueHandler, self).close()
+
+
+def get_logger(queued: bool = False, maxsize: int = 10000,
+               overflow: str = 'block', json_lines: bool = False,
+               batched: bool = False) -> logging.Logger:
+    '''Creates a logger
+
+    With queued set, formatting and writing happen on a background
+    thread behind a bounded queue, see QueueHandler. With batched set,
+    records are buffered and written maxsize at a time, see
+    BatchHandler. With json_lines set, every record is written as one
+    line of JSON.
+    '''
     user_data = logging.Logger('user_data', logging.INFO)
     user_data.propagate = False
-    handler = logging.StreamHandler()
-    handler.setFormatter(RedactingFormatter(PII_FIELDS))
+    if queued:
+        handler = QueueHandler(maxsize=maxsize, overflow=overflow)
+    elif batched:
+        handler = BatchHandler(capacity=maxsize)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(RedactingFormatter(PII_FIELDS, json_lines))
     user_data.addHandler(handler)
 
     return user_data
 
 
-def get_db() -> connection.MySQLConnection:
-    '''Returns a mysql connector'''
+def _connect() -> connection.MySQLConnection:
+    '''Opens a new connection to the personal data database
+
+    PERSONAL_DATA_DB_BACKEND=sqlite opens the PERSONAL_DATA_DB_NAME file
+    with sqlite3 instead of connecting to MySQL.
+    '''
     username = getenv('PERSONAL_DATA_DB_USERNAME', 'root')
     password = getenv('PERSONAL_DATA_DB_PASSWORD', '')
     host = getenv('PERSONAL_DATA_DB_HOST', 'localhost')
     db_name = getenv('PERSONAL_DATA_DB_NAME')
 
+    if getenv('PERSONAL_DATA_DB_BACKEND', 'mysql') == 'sqlite':
+        return sqlite_connect(db_name)
     db = connect(user=username, password=password,
                  host=host, database=db_name)
     return db
 
 
-def main() -> None:
+_pool = None
+
+
+def get_pool() -> ConnectionPool:
+    '''Returns the connection pool of the process
+
+    Sized by PERSONAL_DATA_DB_POOL_SIZE, idle connections are closed
+    after PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT seconds.
+    '''
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            _connect,
+            size=int(getenv('PERSONAL_DATA_DB_POOL_SIZE', '5')),
+            idle_timeout=float(getenv('PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT',
+                                      '300')))
+    return _pool
+
+
+def get_db() -> connection.MySQLConnection:
+    '''Returns a mysql connector
+
+    The connection is borrowed from the pool of the process and closing
+    it hands it back. When every pooled connection is busy, a new one is
+    opened outside the pool. PERSONAL_DATA_DB_POOL_SIZE=0 disables
+    pooling.
+    '''
+    if getenv('PERSONAL_DATA_DB_POOL_SIZE') == '0':
+        return _connect()
+    return get_pool().acquire(overflow=True)
+
+
+def row_message(fields: Sequence[str], row: Sequence) -> str:
+    '''Builds the log message of a table row'''
+    return ''.join(f'{k}={v}; ' for k, v in zip(fields, row)).strip()
+
+
+def _unbuffered_cursor(db):
+    '''Returns a cursor that streams rows from the server'''
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        # sqlite3 cursors never buffer the result set
+        return db.cursor()
+
+
+def _write_batch(formatter: RedactingFormatter, fields: Sequence[str],
+                 batch: Sequence[Sequence], stream: TextIO) -> None:
+    '''Writes table rows as redacted log lines with a single call'''
+    records = [logging.LogRecord('user_data', logging.INFO, __file__, 0,
+                                 row_message(fields, row), None, None)
+               for row in batch]
+    stream.write(formatter.format_batch(records) + '\n')
+
+
+def _write_rows(cursor, stream: TextIO, batch_size: int) -> int:
+    '''Writes the result set of cursor as redacted log lines'''
+    formatter = RedactingFormatter(PII_FIELDS)
+    fields = [column[0] for column in cursor.description]
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return rows
+        _write_batch(formatter, fields, batch, stream)
+        rows += len(batch)
+
+
+def run_stats(rows: int, start: float) -> Dict[str, float]:
+    '''Builds the statistics of an export started at start'''
+    elapsed = time.perf_counter() - start
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'rows': rows,
+            'seconds': elapsed,
+            'rows_per_sec': rows / elapsed if elapsed else 0.0,
+            'peak_rss_kb': peak}
+
+
+def export_users(db=None, stream: TextIO = None,
+                 batch_size: int = 1000) -> Dict[str, float]:
+    '''Streams the users table to stream as redacted log lines
+
+    Rows are fetched batch_size at a time and every batch is formatted,
+    redacted and written with a single call, so memory stays flat
+    whatever the size of the table. Any DB-API connection works, an
+    sqlite3 one included. Returns the run statistics.
+    '''
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    if stream is None:
+        stream = sys.stderr
+    start = time.perf_counter()
+    cursor = _unbuffered_cursor(db)
+    try:
+        cursor.execute("SELECT * FROM users;")
+        rows = _write_rows(cursor, stream, batch_size)
+        stream.flush()
+    finally:
+        cursor.close()
+        if own_db:
+            db.close()
+    return run_stats(rows, start)
+
+
+def _key_ranges(db, key: str, parts: int = None,
+                part_rows: int = 1000) -> List[Tuple[int, int]]:
+    '''Splits the key space of the users table in half-open ranges,
+    parts of them or enough for about part_rows rows each'''
+    cursor = db.cursor()
+    cursor.execute("SELECT MIN({0}), MAX({0}), COUNT(*) FROM users;"
+                   .format(key))
+    low, high, count = cursor.fetchone()
+    cursor.close()
+    if low is None:
+        return []
+    low, high = int(low), int(high)
+    parts = parts or -(-count // max(1, part_rows))
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(i, min(i + step, high + 1)) for i in range(low, high + 1, step)]
+
+
+def _export_range(connect: Callable, key: str, low: int, high: int,
+                  batch_size: int) -> Tuple[int, str]:
+    '''Redacts one key range over its own connection'''
+    db = connect()
+    cursor = _unbuffered_cursor(db)
+    out = io.StringIO()
+    try:
+        cursor.execute("SELECT * FROM users WHERE {0} >= {1} AND {0} < {2} "
+                       "ORDER BY {0};".format(key, low, high))
+        rows = _write_rows(cursor, out, batch_size)
+    finally:
+        cursor.close()
+        db.close()
+    return rows, out.getvalue()
+
+
+def parallel_export_users(connect: Callable = get_db, stream: TextIO = None,
+                          workers: int = None, key: str = 'id',
+                          ordered: bool = True, batch_size: int = 1000,
+                          parts: int = None) -> Dict[str, float]:
+    '''Exports the users table with a pool of worker processes
+
+    The integer column key is split into ranges that the workers fetch
+    and redact over their own connection from connect, which must be
+    picklable. This process writes the results, in key order when
+    ordered is set, as they complete otherwise. Unless parts sets their
+    number, ranges are sized for about batch_size rows each.
+    '''
+    if not re.fullmatch(r'\w+', key):
+        raise ValueError('invalid key column: {}'.format(key))
+    if stream is None:
+        stream = sys.stderr
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    db = connect()
+    try:
+        ranges = _key_ranges(db, key, parts, batch_size)
+    finally:
+        db.close()
+    rows = 0
+    # each range in flight is held whole, as text, by its worker and
+    # then by this process: with ranges of about batch_size rows, a
+    # bounded window of them keeps memory from growing with the table
+    # as long as the keys are spread evenly
+    window = workers * 2
+    todo = iter(ranges)
+    pending = []
+    with ProcessPoolExecutor(workers) as executor:
+        while True:
+            for low, high in islice(todo, window - len(pending)):
+                pending.append(executor.submit(_export_range, connect, key,
+                                               low, high, batch_size))
+            if not pending:
+                break
+            if ordered:
+                done = [pending.pop(0)]
+            else:
+                done = wait(pending, return_when=FIRST_COMPLETED).done
+                pending = [job for job in pending if job not in done]
+            for job in done:
+                count, text = job.result()
+                stream.write(text)
+                rows += count
+    stream.flush()
+    return run_stats(rows, start)
+
+
+def load_checkpoint(path: str) -> Union[List, None]:
+    '''Returns the high-water mark saved at path, if any'''
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, mark: List) -> None:
+    '''Atomically replaces the high-water mark saved at path'''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(mark, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def incremental_export_users(checkpoint: str, db=None,
+                             stream: TextIO = None, key: str = 'last_login',
+                             tiebreaker: str = 'id',
+                             batch_size: int = 1000) -> Dict[str, float]:
+    '''Exports the users rows past the high-water mark in checkpoint
+
+    Rows are read in (key, tiebreaker) order one batch at a time and
+    the mark of the last row written is committed to checkpoint after
+    every batch, so an interrupted run resumes after its last complete
+    batch. A batch written right before a crash may be exported twice.
+    key must grow whenever a row is added or changed; the tiebreaker,
+    the primary key by default, keeps rows sharing a key value from
+    being skipped at a batch boundary. It may only be left out, with
+    None, when key itself is unique, and rows whose key is NULL are then
+    skipped. Otherwise they come first, in tiebreaker order, and a row
+    added with a NULL key once the export is past them is only exported
+    when its key is set.
+    '''
+    if tiebreaker == key:
+        tiebreaker = None
+    columns = [key] + ([tiebreaker] if tiebreaker else [])
+    for column in columns:
+        if not re.fullmatch(r'\w+', column):
+            raise ValueError('invalid key column: {}'.format(column))
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    if stream is None:
+        stream = sys.stderr
+    mark = load_checkpoint(checkpoint)
+    marker = placeholder(db)
+    formatter = RedactingFormatter(PII_FIELDS)
+    rows = 0
+    start = time.perf_counter()
+    cursor = db.cursor()
+    try:
+        while True:
+            # NULL keys sort first, explicitly while the mark is among
+            # them; past them, the plain order can follow an index
+            order = ', '.join(columns)
+            if tiebreaker and (mark is None or mark[0] is None):
+                order = '{} IS NULL DESC, {}'.format(key, order)
+            if not tiebreaker:
+                where, params = 'WHERE {} IS NOT NULL'.format(key), ()
+                if mark is not None:
+                    where = 'WHERE {} > {}'.format(key, marker)
+                    params = (mark[0],)
+            elif mark is None:
+                where, params = '', ()
+            elif mark[0] is None:
+                where = 'WHERE ({0} IS NULL AND {1} > {2}) OR ' \
+                    '{0} IS NOT NULL'.format(key, tiebreaker, marker)
+                params = (mark[1],)
+            else:
+                where = 'WHERE {0} > {2} OR ({0} = {2} AND {1} > {2})'.format(
+                    key, tiebreaker, marker)
+                params = (mark[0], mark[0], mark[1])
+            cursor.execute("SELECT * FROM users {} ORDER BY {} LIMIT {};"
+                           .format(where, order, int(batch_size)), params)
+            batch = cursor.fetchall()
+            if not batch:
+                break
+            fields = [column[0] for column in cursor.description]
+            _write_batch(formatter, fields, batch, stream)
+            stream.flush()
+            mark = [batch[-1][fields.index(c)] for c in columns]
+            save_checkpoint(checkpoint, mark)
+            rows += len(batch)
+    finally:
+        cursor.close()
+        if own_db:
+            db.close()
+    return run_stats(rows, start)
+
+
+def report(stats: Dict[str, float]) -> None:
+    '''Prints export statistics'''
+    print('{rows} rows in {seconds:.3f}s ({rows_per_sec:.0f} rows/sec), '
+          'peak RSS {peak_rss_kb} kB'.format(**stats), file=sys.stderr)
+
+
+def main(argv: List[str] = None) -> None:
     '''Main function'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stream', action='store_true',
+                        help='stream the table in batches')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int,
+                        help='export in parallel with that many processes')
+    parser.add_argument('--checkpoint',
+                        help='only export rows past the mark in this file')
+    parser.add_argument('--key',
+                        help='integer column used to partition the table '
+                        '(id) or high-water mark column (last_login)')
+    parser.add_argument('--tiebreaker', default='id',
+                        help='unique column ordering rows that share a mark '
+                        '(id)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='write partitions as soon as they are ready')
+    args = parser.parse_args(argv)
+    if args.checkpoint:
+        report(incremental_export_users(args.checkpoint,
+                                        key=args.key or 'last_login',
+                                        tiebreaker=args.tiebreaker,
+                                        batch_size=args.batch_size))
+        return
+    if args.workers:
+        report(parallel_export_users(workers=args.workers,
+                                     key=args.key or 'id',
+                                     ordered=not args.unordered,
+                                     batch_size=args.batch_size))
+        return
+    if args.stream:
+        report(export_users(batch_size=args.batch_size))
+        return
+
     db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     logger = get_logger()
     fields = cursor.column_names
     for row in cursor:
-        row_data = []
-        for k, v in zip(fields, row):
-            row_data.append(f'{k}={v}; ')
-        logger.info(''.join(row_data).strip())
+        logger.info(row_message(fields, row))
     cursor.close()
     db.close()
 
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''Bulk loads user_data.csv into the personal data database'''
+import argparse
+import csv
+import re
+import time
+from itertools import islice
+from typing import Dict, Sequence
+
+from db_pool import placeholder
+from encrypt_password import hash_passwords
+from filtered_logger import RedactingFormatter, get_db, report, run_stats
+
+
+def load_csv(path: str, db=None, table: str = 'users',
+             chunk_size: int = 1000, chunks_per_commit: int = 10,
+             hash_columns: Sequence[str] = (),
+             redact_columns: Sequence[str] = ()) -> Dict[str, float]:
+    '''Inserts the rows of a CSV file, whose header names the columns
+
+    The file is read chunk_size rows at a time and every chunk goes in
+    with a single executemany, committed every chunks_per_commit
+    chunks, so memory stays bounded whatever the size of the file.
+    hash_columns are bcrypt hashed and redact_columns replaced by the
+    redaction string on the way. Returns the run statistics.
+    '''
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    start = time.perf_counter()
+    rows = 0
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for name in [table] + header:
+            if not re.fullmatch(r'\w+', name):
+                raise ValueError('invalid identifier: {}'.format(name))
+        hashed = [header.index(c) for c in hash_columns]
+        redacted = [header.index(c) for c in redact_columns]
+        query = "INSERT INTO {} ({}) VALUES ({});".format(
+            table, ', '.join(header),
+            ', '.join([placeholder(db)] * len(header)))
+        cursor = db.cursor()
+        try:
+            chunks = 0
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                for i in redacted:
+                    for row in chunk:
+                        row[i] = RedactingFormatter.REDACTION
+                for i in hashed:
+                    hashes = hash_passwords(row[i] for row in chunk)
+                    for row, h in zip(chunk, hashes):
+                        row[i] = h.decode('utf-8')
+                cursor.executemany(query, chunk)
+                rows += len(chunk)
+                chunks += 1
+                if chunks % chunks_per_commit == 0:
+                    db.commit()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            if own_db:
+                db.close()
+    return run_stats(rows, start)
+
+
+def main() -> None:
+    '''Main function'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', nargs='?', default='user_data.csv')
+    parser.add_argument('--table', default='users')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--chunks-per-commit', type=int, default=10)
+    parser.add_argument('--hash', action='append', default=[],
+                        metavar='COLUMN', help='bcrypt hash this column')
+    parser.add_argument('--redact', action='append', default=[],
+                        metavar='COLUMN', help='redact this column')
+    args = parser.parse_args()
+    report(load_csv(args.path, table=args.table, chunk_size=args.chunk_size,
+                    chunks_per_commit=args.chunks_per_commit,
+                    hash_columns=args.hash, redact_columns=args.redact))
+
+
+if __name__ == '__main__':
+    main()
@@ -56,10 +56,11 @@ class BasicAuth(Auth):
             return None
         if user_pwd is None or type(user_pwd) is not str:
             return None
-        if User.search({'email': user_email}) == []:
+        users = User.search({'email': user_email})
+        if users == []:
             return None
         else:
-            user = User.search({'email': user_email})[0]
+            user = users[0]
             if user.is_valid_password(user_pwd):
                 return user
             else:
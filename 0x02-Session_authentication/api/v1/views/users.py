@@ -2,18 +2,110 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
+from models.query import OPERATORS
 from models.user import User
+from os import getenv
+
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON = 'application/x-ndjson'
+LISTING_PARAMETERS = ('limit', 'after', 'offset', 'order_by', 'format')
+BATCH_SIZE_MAX = int(getenv('USERS_BATCH_SIZE_MAX', 1000))
+
+
+def _positive(name: str, default: int, minimum: int = 1) -> int:
+    """ Integer query parameter, ValueError if it is below minimum
+    """
+    value = request.args.get(name)
+    try:
+        value = int(value) if value is not None else default
+    except ValueError:
+        value = minimum - 1
+    if value < minimum:
+        raise ValueError("{} must be an integer of at least {}".format(
+            name, minimum))
+    return value
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): page size, at most MAX_PAGE_SIZE
+      - after (optional): ID of the last User of the previous page
+      - offset (optional): number of Users to skip
+      - order_by (optional): public attribute to sort by, with a
+        leading '-' for descending order
+      - <attribute> or <attribute>__<operator> (optional): filter on a
+        public attribute, with an operator of models.query.OPERATORS;
+        the values of 'in' are separated by commas. Other parameters
+        are ignored
+      - format (optional): ndjson for one User JSON per line, streamed
+    Pages hold Users in ID order unless order_by is given, PAGE_SIZE of
+    them if limit is not given. An Accept header preferring
+    application/x-ndjson also selects the streamed format.
     Return:
       - list of all User objects JSON represented
+      - with limit, after or offset, the page, and the after value of
+        the next page in the X-Next-Cursor header while there are more,
+        or with order_by the offset of the next page in X-Next-Offset
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    args = request.args
+    public = User.public_attributes()
+    filters = {}
+    for key, value in args.items():
+        if key in LISTING_PARAMETERS:
+            continue
+        attribute, _, op = key.partition('__')
+        if attribute not in public or (op and op not in OPERATORS):
+            continue
+        filters[key] = value.split(',') if key.endswith('__in') else value
+    order_by = args.get('order_by')
+    if order_by is not None and order_by.lstrip('-') not in public:
+        return jsonify({'error': "unknown order_by: {}".format(order_by)}), 400
+    after = args.get('after')
+    paginated = any(k in args for k in ('limit', 'after', 'offset'))
+    if after is not None:
+        if order_by not in (None, 'id'):
+            return jsonify({'error': "after requires the ID order"}), 400
+        filters['id__gt'] = after
+    if paginated and order_by is None:
+        order_by = 'id'
+
+    next_page = None
+    try:
+        limit = offset = None
+        if paginated:
+            limit = min(_positive('limit', PAGE_SIZE), MAX_PAGE_SIZE)
+            offset = _positive('offset', 0, 0)
+        users = User.query(filters, order_by, limit and limit + 1,
+                           offset or 0)
+        if paginated:
+            users = list(users)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if paginated and len(users) > limit:
+        users = users[:limit]
+        if order_by == 'id':
+            next_page = ('X-Next-Cursor', users[-1].id)
+        else:
+            next_page = ('X-Next-Offset', str(offset + limit))
+
+    ndjson = args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best_match(
+            ['application/json', NDJSON]) == NDJSON
+    if ndjson:
+        response = Response((user.to_json_bytes() + b"\n" for user in users),
+                            mimetype=NDJSON)
+    else:
+        response = Response(User.json_list(users),
+                            mimetype='application/json')
+    if next_page is not None:
+        response.headers[next_page[0]] = next_page[1]
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -98,6 +190,136 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+def _batch() -> list:
+    """ Items of a batch request body, ValueError if it is not a list
+    """
+    try:
+        items = request.get_json()
+    except Exception:
+        items = None
+    if type(items) is not list:
+        raise ValueError("Wrong format")
+    return items
+
+
+def _batch_response(results: list, saved: list, errors: list,
+                    status: int, prefix: str = "") -> str:
+    """ Response of a batch, with status if every item succeeds
+
+    saved holds the results of the Users saved together, and errors
+    what save_all returned for them.
+    """
+    for result, error_msg in zip(saved, errors):
+        if error_msg is None:
+            result['user'] = result['user'].to_json()
+        else:
+            del result['user']
+            result.update(status=400, error=prefix + error_msg)
+    if any(result['status'] != status for result in results):
+        status = 207
+    return jsonify(results), status
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body:
+      - list of objects with the fields of POST /api/v1/users
+    Every item is checked before any User is created, and the created
+    Users are written to storage once.
+    Return:
+      - list of results, in the order of the items: the status and the
+        User object JSON represented, or the status and the error
+      - 201 if every User is created, 207 otherwise
+      - 400 if the body is not a list
+      - 413 if there are more than BATCH_SIZE_MAX items
+    """
+    try:
+        items = _batch()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(items) > BATCH_SIZE_MAX:
+        error_msg = "at most {} items".format(BATCH_SIZE_MAX)
+        return jsonify({'error': error_msg}), 413
+    results, saved = [], []
+    for rj in items:
+        error_msg = None
+        if type(rj) is not dict:
+            error_msg = "Wrong format"
+        if error_msg is None and rj.get("email", "") == "":
+            error_msg = "email missing"
+        if error_msg is None and rj.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is None and type(rj.get("email")) is not str:
+            error_msg = "email must be a string"
+        if error_msg is None and type(rj.get("password")) is not str:
+            error_msg = "password must be a string"
+        if error_msg is None:
+            try:
+                user = User()
+                user.email = rj.get("email")
+                user.password = rj.get("password")
+                user.first_name = rj.get("first_name")
+                user.last_name = rj.get("last_name")
+                saved.append({'status': 201, 'user': user})
+                results.append(saved[-1])
+                continue
+            except Exception as e:
+                error_msg = "Can't create User: {}".format(e)
+        results.append({'status': 400, 'error': error_msg})
+    errors = User.save_all([result['user'] for result in saved])
+    return _batch_response(results, saved, errors, 201,
+                           "Can't create User: ")
+
+
+@app_views.route('/users/batch', methods=['PATCH'], strict_slashes=False)
+def update_users() -> str:
+    """ PATCH /api/v1/users/batch
+    JSON body:
+      - list of objects with the id of a User, and the fields of
+        PUT /api/v1/users/:id
+    Every item is checked before any User is updated, and the updated
+    Users are written to storage once.
+    Return:
+      - list of results, in the order of the items: the status and the
+        User object JSON represented, or the status and the error
+      - 200 if every User is updated, 207 otherwise
+      - 400 if the body is not a list
+      - 413 if there are more than BATCH_SIZE_MAX items
+    """
+    try:
+        items = _batch()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(items) > BATCH_SIZE_MAX:
+        error_msg = "at most {} items".format(BATCH_SIZE_MAX)
+        return jsonify({'error': error_msg}), 413
+    results, saved = [], []
+    for rj in items:
+        user = None
+        if type(rj) is not dict:
+            results.append({'status': 400, 'error': "Wrong format"})
+        elif rj.get("id") is None:
+            results.append({'status': 400, 'error': "id missing"})
+        elif type(rj.get("id")) is not str:
+            results.append({'status': 400, 'error': "id must be a string"})
+        else:
+            user = User.get(rj.get("id"))
+            if user is None:
+                results.append({'status': 404, 'error': "Not found"})
+        if user is not None:
+            saved.append({'status': 200, 'user': user, 'item': rj})
+            results.append(saved[-1])
+    for result in saved:
+        user, rj = result['user'], result.pop('item')
+        if rj.get('first_name') is not None:
+            user.first_name = rj.get('first_name')
+        if rj.get('last_name') is not None:
+            user.last_name = rj.get('last_name')
+    errors = User.save_all([result['user'] for result in saved])
+    return _batch_response(results, saved, errors, 200)
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+""" Benchmarks of the model storage
+
+Each measure runs in a fresh process on generated .db_User.json files:
+
+    ./benchmark.py startup --sizes 10000 100000 1000000 -o results.json
+"""
+from datetime import datetime
+from os import path
+from typing import Callable, Dict, List
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+
+ROOT = path.dirname(path.abspath(__file__))
+PROBE = """
+import json, resource, time
+start = time.perf_counter()
+{setup}
+result = {{'seconds': time.perf_counter() - start}}
+{measure}
+result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(result))
+"""
+
+
+def make_store(directory: str, size: int):
+    """ Write a .db_User.json file of size users in directory
+    """
+    with open(path.join(directory, ".db_User.json"), 'w') as f:
+        f.write("{")
+        for i in range(size):
+            obj_id = str(uuid.UUID(int=i))
+            obj_json = {
+                "id": obj_id,
+                "created_at": "2023-03-08T21:49:53",
+                "updated_at": "2023-03-08T21:49:53",
+                "email": "user{}@hbtn.io".format(i),
+                "_password": "{:064x}".format(i),
+                "first_name": "First{}".format(i % 500),
+                "last_name": None}
+            f.write("{}{}: {}".format(", " if i else "", json.dumps(obj_id),
+                                      json.dumps(obj_json)))
+        f.write("}")
+
+
+def probe(directory: str, setup: str, measure: str = "",
+          env: Dict[str, str] = {}) -> Dict:
+    """ Run setup in a fresh process in directory and return its figures
+    """
+    code = PROBE.format(setup=setup, measure=measure)
+    out = subprocess.run([sys.executable, "-c", code], cwd=directory,
+                         env=dict(os.environ, PYTHONPATH=ROOT, **env),
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+LOAD = "from models.user import User\nUser.load_from_file()"
+# the layout before slots: a __dict__ and two datetime objects per user
+LEGACY_LOAD = """
+from datetime import datetime
+FORMAT = "%Y-%m-%dT%H:%M:%S"
+class User():
+    def __init__(self, **kwargs):
+        self.id = kwargs.get('id')
+        self.created_at = datetime.strptime(kwargs['created_at'], FORMAT)
+        self.updated_at = datetime.strptime(kwargs['updated_at'], FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+with open(".db_User.json") as f:
+    DATA = {k: User(**v) for k, v in json.load(f).items()}
+"""
+RSS_BEFORE = """
+import gc, os
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+rss_start = rss_kb()
+"""
+RSS_AFTER = """
+gc.collect()
+result['rss_kb'] = rss_kb()
+result['bytes_per_object'] = (rss_kb() - rss_start) * 1024 // {size}
+"""
+
+LISTING = """
+users = User.all()
+{warm}
+start = time.perf_counter()
+{listing}
+result['seconds'] = time.perf_counter() - start
+"""
+# what jsonify does with the list of to_json dictionaries
+JSONIFY = ("json.dumps([u.to_json() for u in users], sort_keys=True, "
+           "separators=(',', ':'))")
+# what the streamed GET /api/v1/users?format=ndjson does
+NDJSON = """
+for chunk in (u.to_json_bytes() + b"\\n" for u in User.iter_all()):
+    pass
+"""
+# readers and writers sharing the store, in journal storage with group
+# commit so that the writers are not bound by fsync
+STRESS = """
+import random, threading
+from models.base import DATA, _storage
+users = User.all()
+errors, reads, writes = [], [0] * {readers}, [0] * {writers}
+created = [dict() for _ in range({writers})]
+stop = threading.Event()
+
+def reader(n):
+    rnd = random.Random(n)
+    try:
+        while not stop.is_set():
+            user = users[rnd.randrange(len(users))]
+            if User.get(user.id) is not user:
+                raise AssertionError("get lost " + user.id)
+            if User.search({{'email': user.email}}) != [user]:
+                raise AssertionError("search lost " + user.email)
+            if n == 0 and reads[n] % 1000 == 0:
+                sum(1 for _ in User.iter_all())
+                User.search({{'first_name': user.first_name}})
+            User.count()
+            reads[n] += 1
+    except Exception as e:
+        errors.append(repr(e))
+
+def writer(n):
+    rnd = random.Random(-1 - n)
+    try:
+        while not stop.is_set():
+            i = writes[n]
+            if i % 3 == 2 and created[n]:
+                created[n].pop(next(iter(created[n]))).remove()
+            elif i % 3 == 1:
+                user = users[rnd.randrange(len(users))]
+                user.last_name = "Writer{{}}".format(n)
+                user.save()
+            else:
+                user = User(email="w{{}}-{{}}@hbtn.io".format(n, i))
+                user.save()
+                created[n][user.id] = user
+            writes[n] += 1
+    except Exception as e:
+        errors.append(repr(e))
+
+threads = [threading.Thread(target=reader, args=(n,))
+           for n in range({readers})]
+threads += [threading.Thread(target=writer, args=(n,))
+            for n in range({writers})]
+for thread in threads:
+    thread.start()
+time.sleep({duration})
+stop.set()
+for thread in threads:
+    thread.join()
+User.flush()
+
+expected = {{u.id for u in users}}
+for objs in created:
+    expected.update(objs)
+if set(DATA['User']) != expected:
+    errors.append("store holds the wrong users")
+if _storage().indexes['User']['email'].values != {{
+        i: u.email for i, u in DATA['User'].items()}}:
+    errors.append("email index out of date")
+User.load_from_file()
+if set(DATA['User']) != expected:
+    errors.append("reloaded store holds the wrong users")
+result.update(reads_per_sec=sum(reads) / {duration},
+              writes_per_sec=sum(writes) / {duration}, errors=errors)
+"""
+STRESS_ENV = {'STORAGE_TYPE': 'journal', 'STORAGE_FLUSH_INTERVAL': '0.05'}
+# worker processes sharing the json file: each one creates users,
+# updates some of the existing ones and reads what the others wrote
+WORKERS = """
+import multiprocessing
+first = User.all()[:{workers} * {writes}]
+
+def work(n):
+    reads, dup = 0, 0
+    for i in range({writes}):
+        User(email="p{{}}-{{}}@hbtn.io".format(n, i)).save()
+        user = first[n * {writes} + i]
+        user.last_name = "Worker{{}}".format(n)
+        user.save()
+        reads += len(User.search({{'last_name': "Worker0"}})) > 0
+        reads += User.get(user.id) is not None
+    try:
+        User(email="dup@hbtn.io").save()
+        dup = 1
+    except ValueError:
+        pass
+    return reads, dup
+
+with multiprocessing.get_context('fork').Pool({workers}) as pool:
+    start = time.perf_counter()
+    done = pool.map(work, range({workers}))
+    seconds = time.perf_counter() - start
+errors = []
+if sum(dup for _, dup in done) != 1:
+    errors.append("{{}} workers created the same email".format(
+        sum(dup for _, dup in done)))
+if User.count() != {size} + {workers} * {writes} + 1:
+    errors.append("{{}} users instead of {{}}".format(
+        User.count(), {size} + {workers} * {writes} + 1))
+lost = sum(not User.search({{'email': "p{{}}-{{}}@hbtn.io".format(n, i)}})
+           for n in range({workers}) for i in range({writes}))
+lost_updates = sum(
+    User.get(first[n * {writes} + i].id).last_name != "Worker{{}}".format(n)
+    for n in range({workers}) for i in range({writes}))
+if lost or lost_updates:
+    errors.append("lost {{}} users and {{}} updates".format(
+        lost, lost_updates))
+result.update(reads_per_sec=sum(r for r, _ in done) / seconds,
+              writes_per_sec=2 * {workers} * {writes} / seconds,
+              errors=errors)
+"""
+
+# what POST /api/v1/users/batch saves, user by user or all at once
+BATCH = """
+users = [User(email="batch{{}}@hbtn.io".format(i)) for i in range({batch})]
+start = time.perf_counter()
+{save}
+result['seconds'] = time.perf_counter() - start
+User.flush()
+"""
+# JSON and binary snapshot formats, see models.binary_snapshot
+BINARY = {'SNAPSHOT_FORMAT': 'binary'}
+SAVE = """
+import os
+start = time.perf_counter()
+User.save_to_file()
+result['seconds'] = time.perf_counter() - start
+result['file_bytes'] = os.path.getsize(User._file_path())
+"""
+TO_BINARY = """
+from models.binary_snapshot import json_to_binary
+json_to_binary(".db_User.json", ".db_User.bin", ("created_at", "updated_at"))
+"""
+TO_JSON = """
+from models.binary_snapshot import binary_to_json
+binary_to_json(".db_User.bin", ".db_User.json")
+"""
+
+
+def startup(directory: str, size: int) -> List[Dict]:
+    """ Time User.load_from_file, streaming and from the binary cache
+    """
+    results = []
+    for name, env in (('json', {}), ('cache build', {'SNAPSHOT_CACHE': '1'}),
+                      ('cache', {'SNAPSHOT_CACHE': '1'})):
+        result = probe(directory, LOAD, env=env)
+        result['mode'] = name
+        results.append(result)
+    return results
+
+
+def memory(directory: str, size: int) -> List[Dict]:
+    """ Resident memory held by the loaded users: old layout, slots, and
+    SQLite storage once the users are imported
+    """
+    results = []
+    sqlite = {'STORAGE_TYPE': 'sqlite'}
+    for name, load, env in (('dict layout', LEGACY_LOAD, {}),
+                            ('slots', LOAD, {}),
+                            ('sqlite import', LOAD, sqlite),
+                            ('sqlite', LOAD, sqlite)):
+        result = probe(directory, RSS_BEFORE + load,
+                       RSS_AFTER.format(size=size), env=env)
+        result['mode'] = name
+        results.append(result)
+    return results
+
+
+def listing(directory: str, size: int) -> List[Dict]:
+    """ Time the JSON body of GET /api/v1/users, first and second time,
+    streamed, and one page from the middle
+    """
+    results = []
+    for name, warm, body in (
+            ('jsonify', "", JSONIFY),
+            ('jsonify warm', JSONIFY, JSONIFY),
+            ('json_list', "", "User.json_list(users)"),
+            ('json_list warm', "User.json_list(users)",
+             "User.json_list(users)"),
+            ('ndjson', "", NDJSON),
+            ('page', "", "User.page(101, users[len(users) // 2].id)")):
+        result = probe(directory, LOAD,
+                       LISTING.format(warm=warm, listing=body))
+        result['mode'] = name
+        results.append(result)
+    return results
+
+
+def concurrency(directory: str, size: int) -> List[Dict]:
+    """ Read throughput of 4 threads, alone then against 2 writers,
+    checking every read and the store left behind
+    """
+    results = []
+    for name, writers in (('4 readers', 0), ('4 readers 2 writers', 2)):
+        result = probe(directory, LOAD,
+                       STRESS.format(readers=4, writers=writers, duration=3),
+                       env=STRESS_ENV)
+        result['mode'] = name
+        results.append(result)
+    return results
+
+
+def workers(directory: str, size: int) -> List[Dict]:
+    """ 4 processes writing to the same store, STORAGE_SHARED on and off
+    """
+    results = []
+    for name, shared in (('4 workers', '0'), ('4 workers shared', '1')):
+        result = probe(directory, LOAD,
+                       WORKERS.format(workers=4, writes=10, size=size),
+                       env={'STORAGE_SHARED': shared})
+        result['mode'] = name
+        results.append(result)
+        make_store(directory, size)
+    return results
+
+
+def batch(directory: str, size: int) -> List[Dict]:
+    """ Time saving 100 new users one by one, then with save_all, in
+    json and journal storage
+    """
+    results = []
+    for storage in ('json', 'journal'):
+        for name, save in (('save()', "for user in users:\n    user.save()"),
+                           ('save_all', "User.save_all(users)")):
+            result = probe(directory, LOAD, BATCH.format(batch=100, save=save),
+                           env={'STORAGE_TYPE': storage})
+            result['mode'] = "{} 100 users, {}".format(name, storage)
+            results.append(result)
+            make_store(directory, size)
+    return results
+
+
+def snapshot(directory: str, size: int) -> List[Dict]:
+    """ Time User.load_from_file and save_to_file with the JSON and the
+    binary snapshot, and the conversions between them
+    """
+    results = []
+    for name, setup, measure, env in (('json load', LOAD, "", {}),
+                                      ('json save', LOAD, SAVE, {}),
+                                      ('json to binary', TO_BINARY, "", {}),
+                                      ('binary load', LOAD, "", BINARY),
+                                      ('binary save', LOAD, SAVE, BINARY),
+                                      ('binary to json', TO_JSON, "", {})):
+        result = probe(directory, setup, measure, env=env)
+        result['mode'] = name
+        results.append(result)
+    os.remove(path.join(directory, ".db_User.bin"))
+    return results
+
+
+QUERIES = (
+    ('order_by email, 20', "list(User.query(order_by='email', limit=20))"),
+    ('sorted() email, 20',
+     "sorted(User.all(), key=lambda u: u.email)[:20]"),
+    ('email prefix, 20',
+     "list(User.query({'email__startswith': 'user12'}, limit=20))"),
+    ('first_name, 20',
+     "list(User.query({'first_name': 'First7'}, limit=20))"),
+    ('search() first_name, 20',
+     "User.search({'first_name': 'First7'})[:20]"),
+)
+
+
+def query(directory: str, size: int) -> List[Dict]:
+    """ Time the first page of queries through the planner, against
+    building the whole result; the second run has its index sorted
+    """
+    results = []
+    for name, body in QUERIES:
+        for warm in ("", body):
+            result = probe(directory, LOAD,
+                           LISTING.format(warm=warm, listing=body))
+            result['mode'] = name + (" warm" if warm else "")
+            results.append(result)
+    return results
+
+
+SUITES = {
+    'startup': startup,
+    'memory': memory,
+    'listing': listing,
+    'concurrency': concurrency,
+    'workers': workers,
+    'query': query,
+    'batch': batch,
+    'snapshot': snapshot,
+}
+
+
+def main():
+    """ Main function
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('suites', nargs='*',
+                        help="suites among {}, all by default".format(
+                            ", ".join(SUITES)))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('-o', '--output', help="write results to this file")
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error("unknown suite: {}".format(suite))
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            make_store(directory, size)
+            for suite in args.suites or list(SUITES):
+                for result in SUITES[suite](directory, size):
+                    result.update(suite=suite, size=size)
+                    results.append(result)
+                    print("{suite:<11} {size:>9} {mode:<28} {seconds:>8.3f}s"
+                          " {peak_rss_kb:>9} kB".format(**result), end="")
+                    if 'file_bytes' in result:
+                        print(" {:>11} B file".format(result['file_bytes']),
+                              end="")
+                    if 'bytes_per_object' in result:
+                        print(" {:>6} B/object".format(
+                            result['bytes_per_object']), end="")
+                    if 'reads_per_sec' in result:
+                        print(" {:>9.0f} reads/s {:>7.0f} writes/s {}".format(
+                            result['reads_per_sec'], result['writes_per_sec'],
+                            "; ".join(result['errors']) or "ok"), end="")
+                    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'date': datetime.utcnow().isoformat(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+""" Convert a snapshot file between the JSON and the binary format
+
+The direction follows the extension of the source, .json or .bin:
+
+    ./convert_snapshot.py .db_User.json .db_User.bin
+    ./convert_snapshot.py .db_User.bin .db_User.json
+"""
+from models.base import Base
+from models.binary_snapshot import binary_to_json, json_to_binary
+from os import path
+import argparse
+
+
+def main():
+    """ Main function
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('source', help="snapshot file to convert")
+    parser.add_argument('target', help="file to write")
+    parser.add_argument('--timestamps', nargs='*', default=Base._timestamps(),
+                        help="attributes holding times, for a JSON source")
+    args = parser.parse_args()
+    extension = path.splitext(args.source)[1]
+    if extension == ".json":
+        json_to_binary(args.source, args.target, args.timestamps)
+    elif extension == ".bin":
+        binary_to_json(args.source, args.target)
+    else:
+        parser.error("the source must be a .json or a .bin file")
+
+
+if __name__ == "__main__":
+    main()
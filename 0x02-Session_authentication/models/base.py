@@ -1,37 +1,161 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path
+from models.binary_snapshot import read_binary, write_binary
+from models.journal import write_json_atomic
+from models.memory_storage import MemoryStorage
+from models.query import Query
+from models.snapshot import read_snapshot
+from models.sqlite_storage import SQLiteStorage
+from models.storage import Storage
 import json
+import os
+import sys
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
 DATA = {}
+SERIALIZERS = {}
+WRITE_BATCH = 4096
+# 'json' rewrites .db_<class>.json on every change, 'journal' appends
+# the change to .db_<class>.journal and compacts it in the background;
+# both keep every object in memory. 'sqlite' keeps them in SQLITE_PATH
+STORAGE_TYPE = getenv('STORAGE_TYPE', 'json')
+SQLITE_PATH = getenv('SQLITE_PATH', '.db.sqlite3')
+STORAGE = None
+STORAGE_LOCK = threading.Lock()
+JOURNAL_COMPACT_SIZE = int(getenv('JOURNAL_COMPACT_SIZE', 4 * 1024 * 1024))
+# group commit: with an interval, changes are written by a background
+# thread at most once per interval or as soon as enough are pending
+FLUSH_INTERVAL = float(getenv('STORAGE_FLUSH_INTERVAL', 0))
+FLUSH_CHANGES = int(getenv('STORAGE_FLUSH_CHANGES', 100))
+# keep a binary copy of each snapshot file to load instead of the JSON
+SNAPSHOT_CACHE = getenv('SNAPSHOT_CACHE', '0') == '1'
+# 'binary' keeps the snapshot of json and journal storage in
+# .db_<class>.bin, see models.binary_snapshot, instead of the JSON file
+SNAPSHOT_FORMAT = getenv('SNAPSHOT_FORMAT', 'json')
+# json storage shared by several processes: changes are made under an
+# advisory lock of the snapshot file with .lock appended, on the latest
+# version of the file, and every read first reloads it if another
+# process wrote it, or only if it was last checked STORAGE_SHARED_CHECK
+# seconds ago. Changes are then written at once, without group commit
+SHARED = getenv('STORAGE_SHARED', '0') == '1' and STORAGE_TYPE == 'json'
+SHARED_CHECK = float(getenv('STORAGE_SHARED_CHECK', 0))
+
+
+def _storage() -> Storage:
+    """ Storage of the objects, chosen by STORAGE_TYPE on first use
+    """
+    global STORAGE
+    if STORAGE is None:
+        with STORAGE_LOCK:
+            if STORAGE is None and STORAGE_TYPE == 'sqlite':
+                STORAGE = SQLiteStorage(SQLITE_PATH)
+            elif STORAGE is None:
+                STORAGE = MemoryStorage(
+                    DATA, STORAGE_TYPE == 'journal', JOURNAL_COMPACT_SIZE,
+                    FLUSH_INTERVAL, FLUSH_CHANGES, SHARED, SHARED_CHECK)
+    return STORAGE
+
+
+class Timestamp():
+    """ Datetime attribute stored as whole seconds since the epoch
+
+    The value lives in the slot named after the attribute with a
+    leading underscore. Naive datetimes are taken as UTC, like the
+    ones from datetime.utcnow, and text is parsed as ISO 8601.
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        """ Remember the attribute and slot names
+        """
+        self.name = name
+        self.slot = "_{}".format(name)
+
+    def __get__(self, obj: TypeVar('Base'), owner: type = None) -> datetime:
+        """ The stored time as a naive UTC datetime
+        """
+        if obj is None:
+            return self
+        return EPOCH + SECOND * getattr(obj, self.slot)
+
+    def __set__(self, obj: TypeVar('Base'), value):
+        """ Store a datetime or its text as seconds since the epoch,
+        which are also accepted as such
+        """
+        if type(value) is int:
+            setattr(obj, self.slot, value)
+            return
+        if type(value) is str:
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        setattr(obj, self.slot, (value - EPOCH) // SECOND)
+
+    def format(self, value: datetime) -> str:
+        """ A naive UTC datetime formatted with TIMESTAMP_FORMAT
+        """
+        return value.strftime(TIMESTAMP_FORMAT)
+
+    def text(self, obj: TypeVar('Base')) -> str:
+        """ The stored time formatted with TIMESTAMP_FORMAT
+        """
+        return time.strftime(TIMESTAMP_FORMAT,
+                             time.gmtime(getattr(obj, self.slot)))
 
 
 class Base():
     """ Base class
+
+    Subclasses list attributes to index in indexed_attributes, the ones
+    that must hold distinct values also in unique_attributes. Indexes
+    follow save, remove and load_from_file, and search uses them when
+    every searched attribute is indexed.
+
+    Attributes live in __slots__, so a subclass declaring its own
+    attributes in __slots__ has no per-instance __dict__. String
+    attributes listed in interned_attributes are interned on load.
+
+    Every read and write goes through the storage chosen by
+    STORAGE_TYPE (see Storage).
+
+    Serialized forms are cached per object and dropped whenever an
+    attribute is set, save included. Values mutated in place, like a
+    list attribute, are not seen: assign the attribute again instead.
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at', '_cache')
+    indexed_attributes = ()
+    unique_attributes = ()
+    interned_attributes = ()
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        DATA.setdefault(s_class, {})
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        if 'id' in kwargs:
+            self.id = kwargs['id']
+        else:
+            self.id = str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,11 +168,86 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the cached serialized forms
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_cache', None)
+
+    @classmethod
+    def _serializers(cls) -> List[tuple]:
+        """ (key, getter) of every slot attribute, in declaration order
+        """
+        if cls not in SERIALIZERS:
+            serializers = []
+            for klass in reversed(cls.__mro__):
+                for slot in klass.__dict__.get('__slots__', ()):
+                    if slot in ('__dict__', '__weakref__', '_cache'):
+                        continue
+                    timestamp = getattr(cls, slot[1:], None)
+                    if isinstance(timestamp, Timestamp):
+                        serializers.append((slot[1:], timestamp.text))
+                    else:
+                        serializers.append((slot, attrgetter(slot)))
+            SERIALIZERS[cls] = serializers
+        return SERIALIZERS[cls]
+
+    def _cached(self) -> dict:
+        """ Cache of the serialized forms of the object
+        """
+        cache = getattr(self, '_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        cache = self._cached()
+        if for_serialization not in cache:
+            cache[for_serialization] = self._to_json(for_serialization)
+        return dict(cache[for_serialization])
+
+    def to_json_bytes(self) -> bytes:
+        """ The public JSON of the object, encoded like jsonify does
+        """
+        cache = self._cached()
+        if 'bytes' not in cache:
+            obj_json = cache.get(False) or self._to_json(False)
+            cache['bytes'] = json.dumps(obj_json, sort_keys=True,
+                                        separators=(',', ':')).encode()
+        return cache['bytes']
+
+    def _to_json_text(self) -> str:
+        """ The full JSON of the object, as written to the file
+        """
+        cache = self._cached()
+        if 'text' not in cache:
+            obj_json = cache.get(True) or self._to_json(True)
+            cache['text'] = json.dumps(obj_json)
+        return cache['text']
+
+    @classmethod
+    def json_list(cls, objs: Iterable[TypeVar('Base')]) -> bytes:
+        """ JSON array of the public JSON of objs, as jsonify builds it
+        """
+        return b"[" + b",".join(obj.to_json_bytes() for obj in objs) + b"]\n"
+
+    def _to_json(self, for_serialization: bool,
+                 serializers: List[tuple] = None) -> dict:
+        """ Build the JSON dictionary of the object, with serializers
+        instead of the ones of the class if given
+        """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, getter in serializers or self.__class__._serializers():
+            if not for_serialization and key[0] == '_':
+                continue
+            try:
+                result[key] = getter(self)
+            except AttributeError:
+                continue
+        for key, value in getattr(self, '__dict__', {}).items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,55 +257,155 @@ class Base():
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def public_attributes(cls) -> List[str]:
+        """ Names of the attributes shown by to_json
+        """
+        return [key for key, _ in cls._serializers() if key[0] != '_']
+
+    @classmethod
+    def _from_json(cls, obj_json: dict) -> TypeVar('Base'):
+        """ Build an object from its JSON dictionary, interning strings
+        """
+        obj = cls(**obj_json)
+        for attr in cls.interned_attributes:
+            value = getattr(obj, attr, None)
+            if type(value) is str:
+                setattr(obj, attr, sys.intern(value))
+        return obj
+
+    @classmethod
+    def _file_path(cls) -> str:
+        """ Path of the snapshot file of the class
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
+        return ".db_{}.{}".format(
+            cls.__name__, "bin" if SNAPSHOT_FORMAT == 'binary' else "json")
+
+    @classmethod
+    def _timestamps(cls) -> List[str]:
+        """ Names of the Timestamp attributes
+        """
+        return [key for key, _ in cls._serializers()
+                if isinstance(getattr(cls, key, None), Timestamp)]
+
+    @classmethod
+    def _record_serializers(cls) -> List[tuple]:
+        """ Serializers giving the times as seconds since the epoch, as
+        binary snapshots hold them
+        """
+        timestamps = cls._timestamps()
+        return [(key, attrgetter("_{}".format(key)))
+                if key in timestamps else (key, getter)
+                for key, getter in cls._serializers()]
+
+    @classmethod
+    def _read_snapshot(cls) -> Iterator[tuple]:
+        """ (id, object JSON) pairs of the snapshot file, if it exists
+
+        Without a binary snapshot yet, the JSON one is read instead, so
+        that a store switched to the binary format keeps its objects:
+        the next save writes them to the binary file.
+        """
+        file_path = cls._file_path()
+        if SNAPSHOT_FORMAT == 'binary':
+            if path.exists(file_path):
+                return read_binary(file_path)
+            file_path = "{}.json".format(path.splitext(file_path)[0])
         if not path.exists(file_path):
+            return iter(())
+        return read_snapshot(file_path, SNAPSHOT_CACHE)
+
+    @classmethod
+    def _write_snapshot(cls, file_path: str, snapshot: dict):
+        """ Write the object JSON by ID of snapshot to file_path, all
+        or nothing
+        """
+        if SNAPSHOT_FORMAT == 'binary':
+            write_binary(file_path, snapshot.items(), cls._timestamps())
+        else:
+            write_json_atomic(file_path, snapshot)
+
+    @classmethod
+    def _write_objects(cls, file_path: str, objs: List[tuple]):
+        """ Write the (id, object) pairs of objs to file_path
+
+        The file is written aside and renamed over the old one, so
+        readers see either version in full.
+        """
+        if SNAPSHOT_FORMAT == 'binary':
+            serializers = cls._record_serializers()
+            write_binary(file_path, [
+                (obj_id, obj._to_json(True, serializers))
+                for obj_id, obj in objs], cls._timestamps())
             return
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        # same text as json.dump of the whole dictionary, built from
+        # the cached JSON of each object and written in a few large
+        # writes, as each write lets the other threads take the GIL
+        tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write("{")
+            for start in range(0, len(objs), WRITE_BATCH):
+                f.write(", ".join(
+                    "{}: {}".format(json.dumps(obj_id), obj._to_json_text())
+                    for obj_id, obj in objs[start:start + WRITE_BATCH]))
+                if start + WRITE_BATCH < len(objs):
+                    f.write(", ")
+            f.write("}")
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load_from_file(cls):
+        """ Load all objects from file
+        """
+        _storage().load(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        _storage().dump(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def flush(cls):
+        """ Write every change still queued by group commit
+        """
+        _storage().flush()
 
-    def save(self):
+    def save(self, sync: bool = False):
         """ Save current object
+
+        With group commit, sync waits until the object is written.
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        _storage().save(self, sync)
+
+    @classmethod
+    def save_all(cls, objs: List[TypeVar('Base')],
+                 sync: bool = False) -> List[str]:
+        """ Save objects of the class together, persisted once
+
+        Return, for each object, None if it is saved or the reason it
+        is not. An object breaking a unique index, also against the
+        objects before it, is skipped and the others are still saved.
+        With group commit, sync waits until the objects are written.
+        """
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        return _storage().save_all(cls, objs, sync)
 
-    def remove(self):
+    def remove(self, sync: bool = False):
         """ Remove object
+
+        With group commit, sync waits until the removal is written.
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        _storage().remove(self.__class__, self.id, sync)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return _storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -114,24 +413,50 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def iter_all(cls) -> Iterator[TypeVar('Base')]:
+        """ Yield all objects, without building their list
+        """
+        return _storage().iter_all(cls)
+
+    @classmethod
+    def page(cls, limit: int, after: str = None) -> List[TypeVar('Base')]:
+        """ Up to limit objects in ID order, the first ones after that ID
+        """
+        return _storage().page(cls, limit, after)
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return _storage().get(cls, id)
+
+    @classmethod
+    def query(cls, filters: dict = None, order_by: str = None,
+              limit: int = None, offset: int = 0) -> Query:
+        """ Query the objects, lazily
+
+        filters map attribute__operator to values, for instance
+        {'email__startswith': 'bob', 'created_at__ge': '2023-01-01'}
+        (see Predicate). The query only runs when iterated, and only
+        as far as it is iterated.
+        """
+        return Query(cls, filters, order_by, limit, offset)
+
+    @classmethod
+    def _execute(cls, query: Query, explain: bool = False):
+        """ Run a query, or return its plan with explain
+        """
+        return _storage().query(query, explain)
+
+    @classmethod
+    def _is_timestamp(cls, attribute: str) -> bool:
+        """ Whether attribute is a Timestamp
+        """
+        return isinstance(getattr(cls, attribute, None), Timestamp)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return _storage().search(cls, attributes)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+A binary snapshot holds the same (id, object JSON) pairs as a JSON
+snapshot, in this layout, integers being little-endian:
+
+    header  magic "MSNP", version u16, flags u16 (0), count u64,
+            column table length u32
+    table   JSON list of [name, kind] pairs, in the order of the
+            attributes: kind TIME for a timestamp, TEXT for a string
+            or None, JSON for any other value
+    record  length u32 of the rest of the record, one i64 per TIME
+            column, one u32 length per field, then the fields
+
+The fields of a record are its ID, its TEXT columns as UTF-8, its JSON
+columns as JSON text, then the attributes of the object that are not
+columns, or do not fit the kind of their column, as a JSON object.
+Times are whole seconds since the epoch.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Tuple
+from models.journal import write_json_atomic
+from models.snapshot import read_snapshot
+import json
+import mmap
+import os
+import struct
+
+
+MAGIC = b"MSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQI")
+TIME, TEXT, JSON = 't', 's', 'j'
+# values of a field length, and of a time, for None and for a missing
+# attribute
+NONE, MISSING = 0xFFFFFFFF, 0xFFFFFFFE
+NO_TIME, MISSING_TIME = -1 << 63, (-1 << 63) + 1
+TIME_TYPES = (int, str, datetime, type(None))
+# value of a missing attribute
+_ABSENT = object()
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+WRITE_BATCH = 4096
+
+
+def _seconds(value) -> int:
+    """ Seconds since the epoch of a time, given as such, as a naive
+    UTC datetime or as its ISO 8601 text
+    """
+    if type(value) is int:
+        return value
+    if value is None:
+        return NO_TIME
+    if type(value) is str:
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH) // SECOND
+
+
+def _columns(obj_json: dict, timestamps: Iterable[str]) -> dict:
+    """ Kind of every attribute of obj_json, in order
+    """
+    return {key: TIME if key in timestamps else
+            TEXT if value is None or type(value) is str else JSON
+            for key, value in obj_json.items()}
+
+
+def _record(obj_id: str, obj_json: dict, columns: dict,
+            fixed: struct.Struct) -> bytes:
+    """ Encoded record of one object
+
+    A value that does not fit the kind of its column goes with the
+    attributes that are not columns.
+    """
+    times, data, extra, present = [], [obj_id.encode()], {}, 0
+    lengths = [len(data[0])]
+    for key, kind in columns.items():
+        value = obj_json.get(key, _ABSENT)
+        if value is _ABSENT:
+            if kind == TIME:
+                times.append(MISSING_TIME)
+            else:
+                lengths.append(MISSING)
+            continue
+        present += 1
+        if kind == TIME:
+            if type(value) in TIME_TYPES:
+                times.append(_seconds(value))
+                continue
+            times.append(MISSING_TIME)
+        elif kind == JSON:
+            data.append(json.dumps(value).encode())
+            lengths.append(len(data[-1]))
+            continue
+        elif value is None:
+            lengths.append(NONE)
+            continue
+        elif type(value) is str:
+            data.append(value.encode())
+            lengths.append(len(data[-1]))
+            continue
+        else:
+            lengths.append(MISSING)
+        extra[key] = value
+    if present < len(obj_json):
+        extra.update((key, value) for key, value in obj_json.items()
+                     if key not in columns)
+    if extra:
+        data.append(json.dumps(extra).encode())
+        lengths.append(len(data[-1]))
+    else:
+        lengths.append(MISSING)
+    body = b"".join(data)
+    return fixed.pack(fixed.size - 4 + len(body), *times, *lengths) + body
+
+
+def write_binary(file_path: str, items: Iterable[Tuple[str, dict]],
+                 timestamps: Iterable[str] = ()):
+    """ Write the (id, object JSON) pairs of items as a binary snapshot,
+    all or nothing
+
+    Attributes named in timestamps are times, and the attributes of
+    the first object are the columns. The file is written aside,
+    synced and renamed over file_path, so a crash leaves either the old
+    or the new file.
+    """
+    items = list(items)
+    columns = _columns(items[0][1] if items else {}, set(timestamps))
+    times = sum(kind == TIME for kind in columns.values())
+    fixed = struct.Struct("<I{}q{}I".format(
+        times, len(columns) - times + 2))
+    table = json.dumps(list(columns.items())).encode()
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(items), len(table)))
+        f.write(table)
+        for start in range(0, len(items), WRITE_BATCH):
+            f.write(b"".join(
+                _record(obj_id, obj_json, columns, fixed)
+                for obj_id, obj_json in items[start:start + WRITE_BATCH]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def read_binary(file_path: str) -> Iterator[Tuple[str, dict]]:
+    """ Yield the (id, object JSON) pairs of a binary snapshot, with the
+    times as seconds since the epoch
+
+    The file is memory-mapped and decoded one record at a time.
+    ValueError if it is not a complete binary snapshot of VERSION.
+    """
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from _read_records(mm)
+
+
+def _read_records(mm: mmap.mmap) -> Iterator[Tuple[str, dict]]:
+    """ Yield the (id, object JSON) pairs of the mapped snapshot
+    """
+    try:
+        magic, version, _, count, table_size = HEADER.unpack_from(mm)
+    except struct.error:
+        raise ValueError("truncated binary snapshot") from None
+    if magic != MAGIC:
+        raise ValueError("not a binary snapshot")
+    if version != VERSION:
+        raise ValueError("unsupported binary snapshot version: {}".format(
+            version))
+    pos = HEADER.size + table_size
+    columns = json.loads(mm[HEADER.size:pos])
+    times = [key for key, kind in columns if kind == TIME]
+    fields = [(key, kind) for key, kind in columns if kind != TIME]
+    fixed = struct.Struct("<I{}q{}I".format(len(times), len(fields) + 2))
+    # where each column is among the decoded times and fields
+    slots = {key: i for i, key in enumerate(times)}
+    slots.update((key, len(times) + 1 + i) for i, (key, _) in
+                 enumerate(fields))
+    order = [(key, slots[key], kind) for key, kind in columns]
+    for _ in range(count):
+        try:
+            size, *values = fixed.unpack_from(mm, pos)
+        except struct.error:
+            raise ValueError("truncated binary snapshot") from None
+        end = pos + 4 + size
+        blob = mm[pos + fixed.size:end]
+        pos = end
+        if len(blob) != size + 4 - fixed.size:
+            raise ValueError("truncated binary snapshot")
+        # ASCII text, the usual case, is decoded once for all fields
+        text = blob.decode() if blob.isascii() else None
+        offset = 0
+        for i in range(len(times), len(values)):
+            length = values[i]
+            if length >= MISSING:
+                values[i] = None if length == NONE else _ABSENT
+                continue
+            if text is not None:
+                values[i] = text[offset:offset + length]
+            else:
+                values[i] = blob[offset:offset + length].decode()
+            offset += length
+        obj_json = {}
+        for key, i, kind in order:
+            value = values[i]
+            if kind == TIME:
+                if value == MISSING_TIME:
+                    continue
+                obj_json[key] = None if value == NO_TIME else value
+            elif value is _ABSENT:
+                continue
+            elif kind == JSON:
+                obj_json[key] = json.loads(value)
+            else:
+                obj_json[key] = value
+        if values[-1] is not _ABSENT:
+            obj_json.update(json.loads(values[-1]))
+        yield values[len(times)], obj_json
+    if pos != len(mm):
+        raise ValueError("trailing data in binary snapshot")
+
+
+def _text_times(obj_json: dict, times: Iterable[str]) -> dict:
+    """ obj_json with the given times formatted as ISO 8601 text
+    """
+    for key in times:
+        value = obj_json.get(key)
+        if type(value) is int:
+            obj_json[key] = (EPOCH + value * SECOND).isoformat()
+    return obj_json
+
+
+def json_to_binary(json_path: str, binary_path: str,
+                   timestamps: Iterable[str] = ()):
+    """ Convert a JSON snapshot into a binary snapshot, reading the
+    attributes named in timestamps as times
+    """
+    write_binary(binary_path, read_snapshot(json_path), timestamps)
+
+
+def binary_to_json(binary_path: str, json_path: str):
+    """ Convert a binary snapshot into a JSON snapshot, with the times
+    as ISO 8601 text
+    """
+    with open(binary_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            table_size = HEADER.unpack_from(mm)[4]
+            times = [key for key, kind in json.loads(
+                mm[HEADER.size:HEADER.size + table_size]) if kind == TIME]
+    write_json_atomic(json_path, {
+        obj_id: _text_times(obj_json, times)
+        for obj_id, obj_json in read_binary(binary_path)})
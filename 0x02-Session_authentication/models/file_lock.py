@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+""" File lock module
+"""
+import fcntl
+import os
+import threading
+
+
+class FileLock():
+    """ Advisory lock shared by the processes opening the same path
+
+    The lock is exclusive between processes and between threads, and
+    reentrant for the thread holding it. A forked child opens its own
+    lock file instead of sharing the one of its parent.
+    """
+
+    def __init__(self, lock_path: str):
+        """ Initialize the lock on lock_path, created if missing
+        """
+        self.path = lock_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._pid = None
+
+    def __enter__(self) -> 'FileLock':
+        """ Wait for the lock
+        """
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                if self._pid != os.getpid():
+                    self._file = open(self.path, 'a')
+                    self._pid = os.getpid()
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        """ Release the lock
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._lock.release()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+""" Flusher module
+"""
+from typing import Callable, List
+import logging
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Flusher():
+    """ Background thread persisting changes in groups
+
+    Changes are queued per write function and written together at most
+    once every interval seconds, or as soon as max_changes are pending.
+    Every change gets a sequence number that wait() blocks on until
+    the change is written. When a write fails its changes are queued
+    again for the next flush, and wait() raises the error for them
+    until a flush succeeds.
+    """
+
+    def __init__(self, interval: float, max_changes: int):
+        """ Initialize the flusher and start its thread
+        """
+        self.interval = interval
+        self.max_changes = max_changes
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._count = 0
+        self._queued = 0
+        self._written = 0
+        # the last failed flush: changes up to _failed are not written
+        self._failed = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="model-flusher")
+        self._thread.start()
+
+    def add(self, write: Callable[[List], None], changes: List) -> int:
+        """ Queue changes for write and return their sequence number
+
+        write is later called once with the list of all the changes
+        queued for it.
+        """
+        with self._cond:
+            self._pending.setdefault(write, []).extend(changes)
+            self._count += len(changes)
+            self._queued += 1
+            if self._count >= self.max_changes:
+                self._cond.notify_all()
+            return self._queued
+
+    def wait(self, sequence: int):
+        """ Block until the change with this sequence number is written,
+        or raise the error of the last flush if it failed to write it
+        """
+        with self._cond:
+            while self._written < sequence:
+                if sequence <= self._failed:
+                    raise self._error
+                self._cond.wait()
+
+    def flush(self):
+        """ Write every queued change now
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._count = 0
+                sequence = self._queued
+            try:
+                for write, changes in pending.items():
+                    write(changes)
+            except Exception as e:
+                with self._cond:
+                    for write, changes in pending.items():
+                        changes.extend(self._pending.get(write, []))
+                        self._pending[write] = changes
+                        self._count += len(changes)
+                    self._failed, self._error = sequence, e
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._written = max(self._written, sequence)
+                self._cond.notify_all()
+
+    def _run(self):
+        """ Flush every interval, or sooner when enough changes pile up
+        """
+        while True:
+            with self._cond:
+                failing = self._written < self._failed
+                # after a failure, retry once per interval only
+                self._cond.wait_for(
+                    lambda: not failing and self._count >= self.max_changes,
+                    self.interval)
+                if not self._pending:
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                # logged once until a flush succeeds again
+                if not failing:
+                    LOGGER.exception("model flush failed")
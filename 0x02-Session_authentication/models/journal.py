@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+""" Journal module
+"""
+from os import path
+from typing import Callable, Iterator, List
+import json
+import os
+import threading
+
+
+def write_json_atomic(file_path: str, data: dict):
+    """ Write data as JSON to file_path, all or nothing
+
+    The data goes to a temporary file that is synced and then renamed
+    over file_path, so a crash leaves either the old or the new file.
+    """
+    tmp_path = "{}.tmp".format(file_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class Journal():
+    """ Append-only log of the mutations made since the last snapshot
+
+    Every save or remove appends one JSON line, synced to disk before
+    returning. Compaction rotates the log aside, writes a new snapshot
+    and only then deletes the rotated log; records are full object
+    states, so replaying a log over a newer snapshot is harmless.
+    """
+
+    def __init__(self, snapshot_path: str, compact_size: int,
+                 write: Callable[[str, dict], None] = write_json_atomic):
+        """ Initialize the journal of a snapshot file, written with
+        write on compaction
+        """
+        self.snapshot_path = snapshot_path
+        self.write = write
+        self.path = "{}.journal".format(path.splitext(snapshot_path)[0])
+        self.rotated_path = "{}.1".format(self.path)
+        self.compact_size = compact_size
+        self.compacting = False
+        # held through rotate and compact, and by whoever reads the
+        # snapshot and the logs together
+        self.compact_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._truncate_torn_tail()
+        self._file = open(self.path, 'a')
+
+    def _truncate_torn_tail(self):
+        """ Cut a partly written last line so appends start on a new one
+        """
+        if not path.exists(self.path) or path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            f.truncate(f.read().rfind(b"\n") + 1)
+
+    def records(self) -> Iterator[dict]:
+        """ Records to replay over the snapshot, oldest first
+
+        A torn last line, left by a crash in the middle of an append,
+        is ignored.
+        """
+        for file_path in (self.rotated_path, self.path):
+            if not path.exists(file_path):
+                continue
+            with open(file_path, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+
+    def append(self, records: List[dict]) -> bool:
+        """ Durably append records, with a single sync
+
+        Return True when the log has outgrown compact_size.
+        """
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return (not self.compacting and
+                    self._file.tell() >= self.compact_size)
+
+    def rotate(self) -> bool:
+        """ Move the log aside and start a new one before a compaction
+
+        Return False when a compaction is already running.
+        """
+        with self._lock:
+            if self.compacting:
+                return False
+            self.compacting = True
+            self._file.close()
+            if path.exists(self.rotated_path):
+                # leftover of an interrupted compaction: keep its records
+                with open(self.rotated_path, 'a') as rotated, \
+                        open(self.path, 'r') as current:
+                    rotated.write(current.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+            self._file = open(self.path, 'a')
+            return True
+
+    def compact(self, snapshot: dict):
+        """ Write the snapshot taken after rotate and drop the old log
+        """
+        try:
+            self.write(self.snapshot_path, snapshot)
+            os.remove(self.rotated_path)
+        finally:
+            self.compacting = False
+
+    def close(self):
+        """ Close the log file
+        """
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+""" Memory storage module
+"""
+from operator import attrgetter
+from typing import Callable, Iterable, Iterator, List, TypeVar
+from models.file_lock import FileLock
+from models.flusher import Flusher
+from models.journal import Journal
+from models.query import Query
+from models.storage import Storage
+import atexit
+import bisect
+import contextlib
+import heapq
+import os
+import threading
+import time
+
+
+def _stamp(file_path: str) -> tuple:
+    """ Identity of the current version of a file, None if missing
+
+    Files are replaced by rename, so every version has its own inode.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class Index():
+    """ Secondary index: maps the values of one attribute to object IDs
+    """
+
+    def __init__(self, attribute: str, unique: bool = False):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.unique = unique
+        self.ids = {}
+        self.values = {}
+        self._sorted = None
+        self._sorted_lock = threading.Lock()
+
+    def check(self, obj: TypeVar('Base'), accepted: dict = None,
+              claimed: dict = None):
+        """ Raise ValueError if obj can not be indexed or would break a
+        unique index
+
+        For an object saved with others, accepted holds by ID the ones
+        accepted before it, and claimed the ID of the last of them with
+        each value: they are checked against instead of the stored
+        objects with the same IDs.
+        """
+        value = getattr(obj, self.attribute, None)
+        try:
+            hash(value)
+        except TypeError:
+            raise ValueError("{} can not be indexed: {!r}".format(
+                self.attribute, value)) from None
+        if not self.unique or value is None:
+            return
+        accepted, claimed = accepted or {}, claimed or {}
+        holders = [i for i in self.ids.get(value, ()) if i not in accepted]
+        holder = claimed.get(value)
+        if holder is not None and \
+                getattr(accepted[holder], self.attribute, None) == value:
+            holders.append(holder)
+        for obj_id in holders:
+            if obj_id != obj.id:
+                raise ValueError("{} already exists: {}".format(
+                    self.attribute, value))
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index the current value of obj
+        """
+        value = getattr(obj, self.attribute, None)
+        if obj.id in self.values:
+            if self.values[obj.id] == value:
+                return
+            self.discard(obj.id)
+        if value not in self.ids:
+            with self._sorted_lock:
+                self.ids[value] = {}
+                if self._sorted is not None and value is not None:
+                    try:
+                        bisect.insort(self._sorted, value)
+                    except TypeError:
+                        self._sorted = None
+        self.ids[value][obj.id] = None
+        self.values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Forget the object with this ID
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        del ids[obj_id]
+        if not ids:
+            with self._sorted_lock:
+                del self.ids[value]
+                if self._sorted is not None and value is not None:
+                    del self._sorted[bisect.bisect_left(self._sorted, value)]
+
+    def lookup(self, value) -> Iterable[str]:
+        """ IDs of the objects indexed under value
+        """
+        return self.ids.get(value, {})
+
+    def sorted_values(self) -> List:
+        """ The indexed values but None, sorted, None if they do not
+        compare with each other
+
+        The list is built on first use and then kept up to date.
+        """
+        with self._sorted_lock:
+            if self._sorted is None:
+                try:
+                    self._sorted = sorted(v for v in list(self.ids)
+                                          if v is not None)
+                except TypeError:
+                    return None
+            return self._sorted
+
+
+class MemoryStorage(Storage):
+    """ Objects kept in memory, in a dictionary by ID per class name,
+    and persisted to the snapshot file of their class
+
+    Without a journal every change rewrites the snapshot file. With
+    one, changes are appended to the journal of the class and folded
+    into the snapshot file in the background.
+
+    Changes to the objects of a class (save, remove, load) are
+    serialized by a lock of the class. Reads never take it: they work
+    on copies of the dictionary made in one step, so a thread can read
+    while another saves, and sees each object before or after a save.
+    Objects handed out are the stored ones.
+    """
+
+    def __init__(self, data: dict, journal: bool = False,
+                 compact_size: int = 4 * 1024 * 1024,
+                 flush_interval: float = 0, flush_changes: int = 100,
+                 shared: bool = False, shared_check: float = 0):
+        """ Initialize the storage of the objects held in data
+
+        With a flush_interval, changes are written by group commit (see
+        Flusher). shared storage is used by several processes: changes
+        are made under an advisory lock of the snapshot file with .lock
+        appended, on the latest version of the file, and written at
+        once. Every read first reloads the file if another process
+        wrote it, or only if it was last checked shared_check seconds
+        ago.
+        """
+        self.data = data
+        self.journaled = journal
+        self.compact_size = compact_size
+        self.shared = shared
+        self.shared_check = shared_check
+        self.indexes = {}
+        self._journals = {}
+        self._locks = {}
+        self._file_locks = {}
+        self._writers = {}
+        self._stamps = {}
+        self._checked = {}
+        self._flusher = None
+        if flush_interval > 0 and not shared:
+            self._flusher = Flusher(flush_interval, flush_changes)
+            atexit.register(self._flusher.flush)
+
+    def _objects(self, cls: type) -> dict:
+        """ Objects of cls by ID
+        """
+        return self.data.setdefault(cls.__name__, {})
+
+    def _lock(self, cls: type) -> threading.RLock:
+        """ Lock serializing the changes to the objects of cls
+        """
+        s_class = cls.__name__
+        if s_class not in self._locks:
+            self._locks.setdefault(s_class, threading.RLock())
+        return self._locks[s_class]
+
+    def _shared_lock(self, cls: type) -> FileLock:
+        """ Lock of the file of cls between processes, a no-op unless
+        the storage is shared
+        """
+        if not self.shared:
+            return contextlib.nullcontext()
+        s_class = cls.__name__
+        if s_class not in self._file_locks:
+            self._file_locks.setdefault(s_class, FileLock(
+                "{}.lock".format(cls._file_path())))
+        return self._file_locks[s_class]
+
+    def _journal(self, cls: type) -> Journal:
+        """ Journal of cls, opened on first use
+        """
+        s_class = cls.__name__
+        if self._journals.get(s_class) is None:
+            self._journals[s_class] = Journal(cls._file_path(),
+                                              self.compact_size,
+                                              cls._write_snapshot)
+        return self._journals[s_class]
+
+    def load(self, cls: type):
+        """ Load all objects of cls from file
+
+        The file is parsed one object at a time, and the journal, if
+        any, is replayed over it. The class lock is held throughout, so
+        no change is lost between the read and the swap.
+        """
+        s_class = cls.__name__
+        file_path = cls._file_path()
+        journal = self._journal(cls) if self.journaled else None
+        # saves wait for the swap, or they would go to the dropped dict;
+        # a compaction must not replace the files while they are read
+        with self._lock(cls), \
+                journal.compact_lock if journal else contextlib.nullcontext():
+            # taken before reading: a newer file only causes one more
+            # reload
+            stamp = _stamp(file_path)
+            objs = {}
+            for obj_id, obj_json in cls._read_snapshot():
+                objs[obj_id] = cls._from_json(obj_json)
+            for record in journal.records() if journal else ():
+                if record.get('obj') is None:
+                    objs.pop(record['id'], None)
+                else:
+                    objs[record['id']] = cls._from_json(record['obj'])
+            self.data[s_class] = objs
+            self._stamps[s_class] = stamp
+            self.indexes.pop(s_class, None)
+            self._indexes(cls)
+
+    def _refresh(self, cls: type, force: bool = False):
+        """ Reload the objects of cls if another process wrote their file
+
+        Unless forced, the file is checked at most once every
+        shared_check seconds.
+        """
+        if not self.shared:
+            return
+        s_class = cls.__name__
+        file_path = cls._file_path()
+        if not force and self.shared_check > 0:
+            now = time.monotonic()
+            if now - self._checked.get(s_class, 0) < self.shared_check:
+                return
+            self._checked[s_class] = now
+        if _stamp(file_path) == self._stamps.get(s_class):
+            return
+        with self._lock(cls):
+            if _stamp(file_path) != self._stamps.get(s_class):
+                self.load(cls)
+
+    def dump(self, cls: type):
+        """ Write all objects of cls to the snapshot file
+        """
+        file_path = cls._file_path()
+        with self._shared_lock(cls):
+            cls._write_objects(file_path, list(self._objects(cls).items()))
+            self._stamps[cls.__name__] = _stamp(file_path)
+
+    def _persist(self, cls: type, objs: List[tuple]) -> int:
+        """ Persist the new state of objects of cls, given as (ID,
+        object) pairs with None as the object once removed
+
+        With group commit the changes are only queued: return their
+        sequence number to wait on, None when they are already written.
+        """
+        changes = [None]
+        if self.journaled:
+            changes = [{'id': obj_id,
+                        'obj': obj.to_json(True) if obj is not None else None}
+                       for obj_id, obj in objs]
+        if self._flusher is None:
+            self._write(cls, changes)
+            return None
+        return self._flusher.add(self._writer(cls), changes)
+
+    def _writer(self, cls: type) -> Callable[[List[dict]], None]:
+        """ Write function of cls, the same one every time so that group
+        commit writes its changes together
+        """
+        s_class = cls.__name__
+        if s_class not in self._writers:
+            self._writers.setdefault(
+                s_class, lambda changes: self._write(cls, changes))
+        return self._writers[s_class]
+
+    def _wait(self, sequence: int):
+        """ Wait until the change queued with this sequence is written
+        """
+        if sequence is not None:
+            self._flusher.wait(sequence)
+
+    def _write(self, cls: type, changes: List[dict]):
+        """ Write a group of changes of cls to file
+        """
+        if not self.journaled:
+            self.dump(cls)
+        elif self._journal(cls).append(changes):
+            threading.Thread(target=self._compact, args=(cls,),
+                             daemon=True).start()
+
+    def flush(self):
+        """ Write every change still queued by group commit
+        """
+        if self._flusher is not None:
+            self._flusher.flush()
+
+    def _compact(self, cls: type):
+        """ Fold the journal of cls into a new snapshot file
+        """
+        journal = self._journal(cls)
+        with journal.compact_lock:
+            if not journal.rotate():
+                return
+            objs = dict(self._objects(cls))
+            journal.compact({obj_id: obj.to_json(True)
+                             for obj_id, obj in objs.items()})
+
+    def save(self, obj: TypeVar('Base'), sync: bool = False):
+        """ Insert or update obj, ValueError if it breaks a unique index
+        """
+        cls = obj.__class__
+        with self._lock(cls), self._shared_lock(cls):
+            self._refresh(cls, True)
+            indexes = self._indexes(cls).values()
+            for index in indexes:
+                index.check(obj)
+            self._objects(cls)[obj.id] = obj
+            for index in indexes:
+                index.add(obj)
+            sequence = self._persist(cls, [(obj.id, obj)])
+        if sync:
+            self._wait(sequence)
+
+    def save_all(self, cls: type, objs: List[TypeVar('Base')],
+                 sync: bool = False) -> List[str]:
+        """ Insert or update objs of cls together, persisted once, and
+        return for each None or the reason it is not saved
+        """
+        errors, accepted, saved = [], {}, []
+        with self._lock(cls), self._shared_lock(cls):
+            self._refresh(cls, True)
+            indexes = self._indexes(cls).values()
+            # every object is checked before any is stored, so an error
+            # can not leave part of the objects stored but not persisted
+            claims = {index.attribute: {} for index in indexes
+                      if index.unique}
+            for obj in objs:
+                try:
+                    for index in indexes:
+                        index.check(obj, accepted,
+                                    claims.get(index.attribute))
+                except ValueError as e:
+                    errors.append(str(e))
+                    continue
+                accepted[obj.id] = obj
+                saved.append((obj.id, obj))
+                for attr, claimed in claims.items():
+                    value = getattr(obj, attr, None)
+                    if value is not None:
+                        claimed[value] = obj.id
+                errors.append(None)
+            stored = self._objects(cls)
+            for obj_id, obj in saved:
+                stored[obj_id] = obj
+                for index in indexes:
+                    index.add(obj)
+            sequence = self._persist(cls, saved) if saved else None
+        if sync:
+            self._wait(sequence)
+        return errors
+
+    def remove(self, cls: type, obj_id: str, sync: bool = False):
+        """ Delete the object of cls with this ID
+        """
+        with self._lock(cls), self._shared_lock(cls):
+            self._refresh(cls, True)
+            if self._objects(cls).pop(obj_id, None) is None:
+                return
+            for index in self._indexes(cls).values():
+                index.discard(obj_id)
+            sequence = self._persist(cls, [(obj_id, None)])
+        if sync:
+            self._wait(sequence)
+
+    def _indexes(self, cls: type) -> dict:
+        """ Indexes of cls, by attribute
+        """
+        s_class = cls.__name__
+        indexes = self.indexes.get(s_class)
+        if indexes is None:
+            with self._lock(cls):
+                if self.indexes.get(s_class) is None:
+                    indexes = {attr: Index(attr, attr in cls.unique_attributes)
+                               for attr in cls.indexed_attributes}
+                    for index in indexes.values():
+                        for obj in self._objects(cls).values():
+                            index.add(obj)
+                    self.indexes[s_class] = indexes
+                indexes = self.indexes[s_class]
+        return indexes
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ The object of cls with this ID, None if there is none
+        """
+        self._refresh(cls)
+        try:
+            return self._objects(cls).get(obj_id)
+        except TypeError:
+            return None
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of cls
+        """
+        self._refresh(cls)
+        return len(self._objects(cls))
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of cls whose attributes have the given values
+
+        Uses the indexes when every attribute is indexed, instead of
+        scanning all the objects.
+        """
+        self._refresh(cls)
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        objs = self._objects(cls)
+        indexes = self._indexes(cls)
+        if attributes and all(k in indexes for k in attributes):
+            try:
+                ids = [indexes[k].lookup(v) for k, v in attributes.items()]
+            except TypeError:
+                ids = None
+            if ids is not None:
+                ids.sort(key=len)
+                found = (objs.get(i) for i in list(ids[0])
+                         if all(i in other for other in ids[1:]))
+                return [obj for obj in found
+                        if obj is not None and _search(obj)]
+        return list(filter(_search, list(objs.values())))
+
+    def iter_all(self, cls: type) -> Iterator[TypeVar('Base')]:
+        """ Yield every object of cls
+
+        Objects removed meanwhile are skipped, objects added are not
+        seen.
+        """
+        self._refresh(cls)
+        objs = self._objects(cls)
+        for obj_id in list(objs):
+            obj = objs.get(obj_id)
+            if obj is not None:
+                yield obj
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Up to limit objects of cls in ID order, after that ID
+
+        Only limit objects are held while scanning, so a page costs the
+        same memory whatever the number of objects.
+        """
+        objs = self.iter_all(cls)
+        if after is not None:
+            objs = (obj for obj in objs if obj.id > after)
+        return heapq.nsmallest(limit, objs, key=attrgetter('id'))
+
+    def query(self, query: Query, explain: bool = False):
+        """ Iterator over the results of query, or its plan with explain
+        """
+        cls = query.cls
+        self._refresh(cls)
+        objs, indexes = self._objects(cls), self._indexes(cls)
+        if explain:
+            return query.plan(objs, indexes)[0]
+        return query.run(objs, indexes)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+""" Query module
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, TypeVar
+import heapq
+import operator
+
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'startswith': lambda a, b: type(a) is str and a.startswith(b),
+    'in': lambda a, b: a in b,
+}
+# highest code point: every string starting with a prefix sorts below
+# the prefix followed by it, unless it follows it with this very one
+MAX_CHAR = "\U0010ffff"
+
+
+class Predicate():
+    """ Condition on one attribute
+
+    Filters are written attribute__operator: value, with the operators
+    of OPERATORS, or attribute: value for eq. Timestamp attributes
+    also accept their ISO 8601 text, and do not take startswith. An
+    attribute that is missing, or that cannot be compared to the
+    value, does not match.
+    """
+
+    def __init__(self, cls: type, key: str, value):
+        """ Initialize the predicate of one filter of cls
+        """
+        attribute, _, op = key.partition('__')
+        op = op or 'eq'
+        if op not in OPERATORS:
+            raise ValueError("unknown operator: {}".format(op))
+        if op == 'in':
+            value = tuple(value)
+        if cls._is_timestamp(attribute):
+            if op == 'startswith':
+                raise ValueError("startswith does not apply to times: "
+                                 "{}".format(attribute))
+            if op == 'in':
+                value = tuple(_datetime(v) for v in value)
+            else:
+                value = _datetime(value)
+        self.attribute = attribute
+        self.op = op
+        self.value = value
+        self._test = OPERATORS[op]
+
+    def match(self, obj: TypeVar('Base')) -> bool:
+        """ Whether obj meets the condition
+        """
+        try:
+            return self._test(getattr(obj, self.attribute, None), self.value)
+        except TypeError:
+            return False
+
+    def bounds(self, values: List) -> Tuple[int, int]:
+        """ Slice of the sorted values meeting a range condition
+        """
+        value = self.value
+        if self.op == 'lt':
+            return 0, bisect_left(values, value)
+        if self.op == 'le':
+            return 0, bisect_right(values, value)
+        if self.op == 'gt':
+            return bisect_right(values, value), len(values)
+        if self.op == 'ge':
+            return bisect_left(values, value), len(values)
+        return (bisect_left(values, value),
+                bisect_left(values, value + MAX_CHAR))
+
+
+def _datetime(value):
+    """ The datetime of an ISO 8601 text, other values as they are
+    """
+    return datetime.fromisoformat(value) if type(value) is str else value
+
+
+class Query():
+    """ Lazy query over the objects of a class
+
+    Iterating runs the query and yields the objects one by one, so
+    stopping early skips the rest of the work. order_by names an
+    attribute, with a leading '-' for descending order; objects whose
+    attribute is None come last, and ties come in ID order, reversed
+    for descending order.
+    """
+
+    def __init__(self, cls: type, filters: dict = None, order_by: str = None,
+                 limit: int = None, offset: int = 0):
+        """ Initialize the query of the objects of cls
+        """
+        self.cls = cls
+        self.predicates = [Predicate(cls, k, v)
+                           for k, v in (filters or {}).items()]
+        self.descending = order_by is not None and order_by[:1] == '-'
+        self.order_by = order_by[1:] if self.descending else order_by
+        self.limit = limit
+        self.offset = offset
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Run the query
+        """
+        return self.cls._execute(self)
+
+    def explain(self) -> str:
+        """ How the query finds its objects
+        """
+        return self.cls._execute(self, explain=True)
+
+    def match(self, obj: TypeVar('Base')) -> bool:
+        """ Whether obj meets every condition
+        """
+        return all(p.match(obj) for p in self.predicates)
+
+    def sort_key(self, obj: TypeVar('Base')) -> tuple:
+        """ Key ordering objects by order_by, None last
+        """
+        value = getattr(obj, self.order_by, None)
+        if self.descending:
+            return value is not None, value, obj.id
+        return value is None, value, obj.id
+
+    def window(self, objs: Iterable) -> Iterator[TypeVar('Base')]:
+        """ The objects between offset and offset + limit
+        """
+        stop = None if self.limit is None else self.offset + self.limit
+        return islice(objs, self.offset, stop)
+
+    def plan(self, objs: dict, indexes: dict) -> Tuple[str, Iterable, bool]:
+        """ Choose how to find the candidates among objs, the objects by
+        ID, given the indexes by attribute
+
+        Return the plan, the candidates, and whether they already come
+        in order. An equality on an indexed attribute is preferred,
+        then a range on one, then walking the index of order_by; the
+        last resort is a scan of every object.
+        """
+        indexed = [p for p in self.predicates if p.attribute in indexes]
+        for p in sorted(indexed, key=lambda p: p.op != 'eq'):
+            index = indexes[p.attribute]
+            if p.op in ('eq', 'in'):
+                try:
+                    values = [p.value] if p.op == 'eq' else dict.fromkeys(
+                        p.value)
+                    ids = [list(index.lookup(v)) for v in values]
+                except TypeError:
+                    continue
+                return ("index {} {}".format(p.op, p.attribute),
+                        _objects(objs, (i for group in ids for i in group)),
+                        False)
+            values = index.sorted_values()
+            if p.op == 'ne' or values is None:
+                continue
+            try:
+                start, stop = p.bounds(values)
+            except TypeError:
+                continue
+            ordered = p.attribute == self.order_by
+            values = values[start:stop]
+            if ordered and self.descending:
+                values.reverse()
+            return ("index range {}".format(p.attribute),
+                    _objects(objs, _ids(index, values, ordered and
+                                        self.descending)), ordered)
+        index = indexes.get(self.order_by)
+        values = index.sorted_values() if index is not None else None
+        if values is not None:
+            values = values[::-1] if self.descending else values[:]
+            values.append(None)
+            return ("index order {}".format(self.order_by),
+                    _objects(objs, _ids(index, values, self.descending)),
+                    True)
+        return "scan", list(objs.values()), self.order_by is None
+
+    def run(self, objs: dict, indexes: dict) -> Iterator[TypeVar('Base')]:
+        """ Yield the results, from objs and indexes as for plan
+        """
+        _, candidates, ordered = self.plan(objs, indexes)
+        return self.finish(filter(self.match, candidates), ordered)
+
+    def finish(self, found: Iterable, ordered: bool) -> Iterator:
+        """ The window of the objects found, sorted unless ordered
+        """
+        if self.order_by is not None and not ordered:
+            if self.limit is not None:
+                pick = heapq.nlargest if self.descending else heapq.nsmallest
+                found = pick(self.offset + self.limit, found,
+                             key=self.sort_key)
+            else:
+                found = sorted(found, key=self.sort_key,
+                               reverse=self.descending)
+        return self.window(found)
+
+
+def _ids(index, values: List, descending: bool) -> Iterator[str]:
+    """ IDs indexed under each of values in turn, each group in order
+    """
+    for value in values:
+        ids = sorted(index.lookup(value), reverse=descending)
+        yield from ids
+
+
+def _objects(objs: dict, ids: Iterable[str]) -> Iterator[TypeVar('Base')]:
+    """ The objects of ids still in objs
+    """
+    for obj_id in ids:
+        obj = objs.get(obj_id)
+        if obj is not None:
+            yield obj
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+""" Snapshot module
+"""
+from os import path
+from typing import IO, Iterator, List, Tuple
+import json
+import marshal
+import os
+import re
+
+
+CHUNK_SIZE = 1 << 16
+CACHE_VERSION = 1
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_object(f: IO[str],
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple]:
+    """ Yield the (key, value) members of the JSON object in f
+
+    The file is read chunk_size characters at a time and each member is
+    decoded on its own, so only one of them is held at once.
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size)
+    pos = _WHITESPACE.match(buf).end()
+    if buf[pos:pos + 1] != '{':
+        raise ValueError("expected a JSON object")
+    pos += 1
+    while True:
+        while True:
+            try:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if buf[pos] == '}':
+                    return
+                key, end = decoder.raw_decode(buf, pos)
+                end = _WHITESPACE.match(buf, end).end()
+                if buf[end] != ':':
+                    raise ValueError("expected ':'")
+                end = _WHITESPACE.match(buf, end + 1).end()
+                value, end = decoder.raw_decode(buf, end)
+                end = _WHITESPACE.match(buf, end).end()
+                if buf[end] not in ',}':
+                    raise ValueError("expected ',' or '}'")
+                break
+            except (ValueError, IndexError):
+                # the member may just be cut by the end of the buffer
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buf = buf[pos:] + more
+                pos = 0
+        yield key, value
+        pos = end + 1 if buf[end] == ',' else end
+
+
+def _cache_path(file_path: str) -> str:
+    """ Path of the binary cache of a JSON snapshot
+    """
+    return "{}.cache".format(path.splitext(file_path)[0])
+
+
+def _source_stamp(file_path: str) -> Tuple[int, int]:
+    """ Size and modification time identifying a snapshot version
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _write_cache(cache_path: str, stamp: Tuple[int, int], items: List):
+    """ Write the binary cache of a snapshot
+
+    Objects sharing the same attributes, the usual case, are stored as
+    one tuple of names and a tuple of values per object, which loads
+    several times faster than dictionaries.
+    """
+    columns = tuple(items[0][1]) if items else ()
+    if all(tuple(obj_json) == columns for _, obj_json in items):
+        rows = [(obj_id, tuple(obj_json.values()))
+                for obj_id, obj_json in items]
+    else:
+        columns, rows = None, items
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(marshal.dumps((CACHE_VERSION, stamp, columns, rows)))
+    os.replace(tmp_path, cache_path)
+
+
+def _read_cache(cache_path: str, stamp: Tuple[int, int]) -> Iterator[Tuple]:
+    """ (id, object JSON) pairs of a cache, None if it is stale
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            version, source_stamp, columns, rows = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if version != CACHE_VERSION or tuple(source_stamp) != stamp:
+        return None
+    if columns is None:
+        return iter(rows)
+    return ((obj_id, dict(zip(columns, values))) for obj_id, values in rows)
+
+
+def read_snapshot(file_path: str, cache: bool = False) -> Iterator[Tuple]:
+    """ Yield the (id, object JSON) pairs of a JSON snapshot
+
+    With cache set, a binary copy of the snapshot is kept next to it
+    and read instead of the JSON as long as the JSON is unchanged.
+    """
+    if not cache:
+        with open(file_path, 'r') as f:
+            yield from iter_json_object(f)
+        return
+
+    stamp = _source_stamp(file_path)
+    cache_path = _cache_path(file_path)
+    items = _read_cache(cache_path, stamp)
+    if items is None:
+        with open(file_path, 'r') as f:
+            items = list(iter_json_object(f))
+        _write_cache(cache_path, stamp, items)
+    yield from items
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+"""
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Tuple, TypeVar
+from models.query import MAX_CHAR, Predicate, Query
+from models.storage import Storage
+import json
+import os
+import sqlite3
+import threading
+
+
+# column holding, as JSON, the attributes that have no column of their own
+EXTRA = "_extra"
+# rows read per query by iter_all, and written per transaction on import
+BATCH_SIZE = 1000
+BINDABLE = (str, int, float, bytes, type(None))
+# raised for a value of another type, depending on the Python version
+UNBINDABLE = (sqlite3.InterfaceError, sqlite3.ProgrammingError)
+SQL_OPERATORS = {'eq': "=", 'ne': "IS NOT", 'lt': "<", 'le': "<=",
+                 'gt': ">", 'ge': ">="}
+
+
+def _quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Table():
+    """ Columns and statements of the table of a class
+
+    There is one column per attribute of the class, in to_json order,
+    and the EXTRA column. The statements are built once, and sqlite3
+    keeps them prepared for each connection.
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize the table of cls
+        """
+        self.name = _quote(cls.__name__)
+        self.attributes = [key for key, _ in cls._serializers()]
+        columns = ", ".join(_quote(c) for c in self.attributes + [EXTRA])
+        self.select = "SELECT {} FROM {}".format(columns, self.name)
+        self.insert = (
+            "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT(id) DO UPDATE SET {}"
+            .format(self.name, columns, ", ".join(
+                "?" for _ in range(len(self.attributes) + 1)), ", ".join(
+                "{0} = excluded.{0}".format(_quote(c))
+                for c in self.attributes[1:] + [EXTRA])))
+        self.delete = "DELETE FROM {} WHERE id = ?".format(self.name)
+        self.get = "{} WHERE id = ?".format(self.select)
+        self.count = "SELECT COUNT(*) FROM {}".format(self.name)
+        self.page = "{} WHERE id > ? ORDER BY id LIMIT ?".format(self.select)
+        self.first_page = "{} ORDER BY id LIMIT ?".format(self.select)
+
+    def create(self, db: sqlite3.Connection, cls: type):
+        """ Create the table and its indexes, adding missing columns
+        """
+        db.execute("CREATE TABLE IF NOT EXISTS {} (id TEXT PRIMARY KEY)"
+                   .format(self.name))
+        existing = {row[1] for row in db.execute(
+            "PRAGMA table_info({})".format(self.name))}
+        for column in self.attributes + [EXTRA]:
+            if column not in existing:
+                db.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                    self.name, _quote(column)))
+        for attr in cls.indexed_attributes:
+            db.execute("CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format(
+                "UNIQUE " if attr in cls.unique_attributes else "",
+                _quote("{}_{}".format(cls.__name__, attr)), self.name,
+                _quote(attr)))
+
+    def row(self, obj: TypeVar('Base')) -> list:
+        """ Column values of obj
+        """
+        obj_json = obj.to_json(True)
+        row = [obj_json.pop(attr, None) for attr in self.attributes]
+        row.append(json.dumps(obj_json) if obj_json else None)
+        return row
+
+    def object(self, cls: type, row: tuple) -> TypeVar('Base'):
+        """ Object of cls built from its row
+        """
+        obj_json = dict(zip(self.attributes, row))
+        if row[-1] is not None:
+            obj_json.update(json.loads(row[-1]))
+        return cls._from_json(obj_json)
+
+
+class SQLiteStorage(Storage):
+    """ Objects kept in an SQLite database, one table per class
+
+    Attributes in indexed_attributes are indexed, with a unique index
+    for the ones in unique_attributes. Only the objects a query returns
+    are held in memory. Each thread gets its own connection, and the
+    database is in WAL mode so that readers do not wait for writers.
+    """
+
+    def __init__(self, database: str):
+        """ Initialize the storage in the database file
+        """
+        self.database = database
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def _db(self) -> sqlite3.Connection:
+        """ Connection of the current thread, opened on first use
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.database, isolation_level=None)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _table(self, cls: type) -> Table:
+        """ Table of cls, created on first use
+        """
+        table = self._tables.get(cls)
+        if table is None:
+            with self._lock:
+                if cls not in self._tables:
+                    table = Table(cls)
+                    table.create(self._db(), cls)
+                    self._tables[cls] = table
+                table = self._tables[cls]
+        return table
+
+    def load(self, cls: type):
+        """ Create the table of cls, filled from the snapshot file of
+        cls if it is empty and the file exists
+        """
+        table = self._table(cls)
+        db = self._db()
+        if db.execute("{} LIMIT 1".format(table.select)).fetchone():
+            return
+        objs = (cls._from_json(obj_json)
+                for _, obj_json in cls._read_snapshot())
+        while True:
+            rows = [table.row(obj) for obj in islice(objs, BATCH_SIZE)]
+            if not rows:
+                break
+            with db:
+                db.execute("BEGIN")
+                db.executemany(table.insert, rows)
+
+    def dump(self, cls: type):
+        """ Write all objects of cls to the snapshot file
+        """
+        cls._write_objects(cls._file_path(), [
+            (obj.id, obj) for obj in self.iter_all(cls)])
+
+    def save(self, obj: TypeVar('Base'), sync: bool = False):
+        """ Insert or update obj, ValueError if it breaks a unique index
+        or has a value that can not be stored
+
+        Changes are written at once, so sync has nothing to wait for.
+        """
+        table = self._table(obj.__class__)
+        try:
+            self._db().execute(table.insert, table.row(obj))
+        except sqlite3.IntegrityError as e:
+            raise ValueError(self._conflict(obj, e)) from None
+        except UNBINDABLE as e:
+            raise ValueError(str(e)) from None
+
+    def save_all(self, cls: type, objs: List[TypeVar('Base')],
+                 sync: bool = False) -> List[str]:
+        """ Insert or update objs of cls in one transaction, and return
+        for each None or the reason it is not saved
+        """
+        table = self._table(cls)
+        db = self._db()
+        errors = []
+        with db:
+            db.execute("BEGIN")
+            for obj in objs:
+                try:
+                    db.execute(table.insert, table.row(obj))
+                except sqlite3.IntegrityError as e:
+                    errors.append(self._conflict(obj, e))
+                except UNBINDABLE as e:
+                    errors.append(str(e))
+                else:
+                    errors.append(None)
+        return errors
+
+    @staticmethod
+    def _conflict(obj: TypeVar('Base'), error: sqlite3.IntegrityError) -> str:
+        """ Message of a unique index broken by obj
+        """
+        attr = str(error).rpartition(".")[2]
+        return "{} already exists: {}".format(attr, getattr(obj, attr, None))
+
+    def remove(self, cls: type, obj_id: str, sync: bool = False):
+        """ Delete the object of cls with this ID
+        """
+        self._db().execute(self._table(cls).delete, (obj_id,))
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ The object of cls with this ID, None if there is none
+        """
+        table = self._table(cls)
+        if type(obj_id) not in BINDABLE:
+            return None
+        row = self._db().execute(table.get, (obj_id,)).fetchone()
+        return table.object(cls, row) if row is not None else None
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of cls
+        """
+        return self._db().execute(self._table(cls).count).fetchone()[0]
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of cls whose attributes have the given values
+
+        Attributes with a column are matched in SQL, through their
+        index if they have one, the others on the objects found.
+        """
+        table = self._table(cls)
+        conditions, params, others = [], [], {}
+        for k, v in attributes.items():
+            if k not in table.attributes or type(v) not in BINDABLE:
+                others[k] = v
+            elif v is None:
+                conditions.append("{} IS NULL".format(_quote(k)))
+            else:
+                conditions.append("{} = ?".format(_quote(k)))
+                params.append(v)
+        query = table.select
+        if conditions:
+            query = "{} WHERE {}".format(query, " AND ".join(conditions))
+        objs = [table.object(cls, row)
+                for row in self._db().execute(query, params)]
+        return [obj for obj in objs
+                if all(getattr(obj, k) == v for k, v in others.items())]
+
+    def iter_all(self, cls: type) -> Iterator[TypeVar('Base')]:
+        """ Yield every object of cls in ID order, BATCH_SIZE rows at once
+        """
+        after = None
+        while True:
+            objs = self.page(cls, BATCH_SIZE, after)
+            yield from objs
+            if len(objs) < BATCH_SIZE:
+                return
+            after = objs[-1].id
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Up to limit objects of cls in ID order, after that ID
+        """
+        table = self._table(cls)
+        if after is None:
+            rows = self._db().execute(table.first_page, (limit,))
+        else:
+            rows = self._db().execute(table.page, (after, limit))
+        return [table.object(cls, row) for row in rows]
+
+    def _condition(self, cls: type, table: Table,
+                   predicate: Predicate) -> Tuple[str, list]:
+        """ SQL condition and parameters of a predicate, None if it has
+        to be checked on the objects
+
+        Stored times have whole seconds, so only such times are
+        compared in SQL.
+        """
+        if predicate.attribute not in table.attributes:
+            return None
+        op = predicate.op
+        values = list(predicate.value) if op == 'in' else [predicate.value]
+        if cls._is_timestamp(predicate.attribute):
+            if not all(type(v) is datetime and v.tzinfo is None and
+                       not v.microsecond for v in values):
+                return None
+            timestamp = getattr(cls, predicate.attribute)
+            values = [timestamp.format(v) for v in values]
+        if not all(type(v) in BINDABLE for v in values):
+            return None
+        column = _quote(predicate.attribute)
+        if op == 'in':
+            if None in values:
+                return None
+            return "{} IN ({})".format(column, ", ".join(
+                "?" for _ in values)) if values else "0", values
+        value = values[0]
+        if op == 'startswith':
+            if type(value) is not str:
+                return "0", []
+            return "{0} >= ? AND {0} < ?".format(column), [
+                value, value + MAX_CHAR]
+        if value is None:
+            if op in ('eq', 'ne'):
+                return "{} {} NULL".format(column, "IS" if op == 'eq'
+                                           else "IS NOT"), []
+            return "0", []
+        return "{} {} ?".format(column, SQL_OPERATORS[op]), [value]
+
+    def query(self, query: Query, explain: bool = False):
+        """ Iterator over the results of query, or its plan with explain
+
+        Conditions, ordering and the window go to SQL when they can,
+        the rest is done on the objects as they are read.
+        """
+        cls = query.cls
+        table = self._table(cls)
+        conditions, params, in_sql = [], [], True
+        for predicate in query.predicates:
+            condition = self._condition(cls, table, predicate)
+            if condition is None:
+                in_sql = False
+                continue
+            conditions.append(condition[0])
+            params.extend(condition[1])
+        sql = table.select
+        if conditions:
+            sql = "{} WHERE {}".format(sql, " AND ".join(conditions))
+        ordered = query.order_by is None
+        if query.order_by in table.attributes:
+            direction = "DESC" if query.descending else "ASC"
+            if query.order_by == 'id':
+                # never NULL, and then the primary key gives the order
+                sql = "{} ORDER BY id {}".format(sql, direction)
+            else:
+                sql = "{0} ORDER BY {1} IS NULL, {1} {2}, id {2}".format(
+                    sql, _quote(query.order_by), direction)
+            ordered = True
+        window = in_sql and ordered
+        if window and (query.limit is not None or query.offset):
+            sql = "{} LIMIT ? OFFSET ?".format(sql)
+            params += [-1 if query.limit is None else query.limit,
+                       query.offset]
+        db = self._db()
+        if explain:
+            return "sql: {} ({})".format(sql, "; ".join(
+                row[-1] for row in db.execute(
+                    "EXPLAIN QUERY PLAN {}".format(sql), params)))
+        objs = (table.object(cls, row) for row in db.execute(sql, params))
+        if window:
+            return objs
+        return query.finish(filter(query.match, objs), ordered)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Storage module
+"""
+from abc import ABC, abstractmethod
+from typing import Iterator, List, TypeVar
+from models.query import Query
+
+
+class Storage(ABC):
+    """ Storage of the Base objects
+
+    Every read and write of Base goes through the storage selected by
+    STORAGE_TYPE: MemoryStorage for json and journal storage, which
+    hands out the stored objects, or SQLiteStorage, which hands out
+    copies, so that saving one writes it back.
+    """
+
+    @abstractmethod
+    def load(self, cls: type):
+        """ Prepare the storage of cls from its snapshot file
+        """
+
+    @abstractmethod
+    def dump(self, cls: type):
+        """ Write all objects of cls to the snapshot file
+        """
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base'), sync: bool = False):
+        """ Insert or update obj, ValueError if it breaks a unique index
+
+        With group commit, sync waits until obj is written.
+        """
+
+    @abstractmethod
+    def save_all(self, cls: type, objs: List[TypeVar('Base')],
+                 sync: bool = False) -> List[str]:
+        """ Insert or update objs of cls together, and return for each
+        None or the reason it is not saved
+        """
+
+    @abstractmethod
+    def remove(self, cls: type, obj_id: str, sync: bool = False):
+        """ Delete the object of cls with this ID
+        """
+
+    @abstractmethod
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ The object of cls with this ID, None if there is none
+        """
+
+    @abstractmethod
+    def count(self, cls: type) -> int:
+        """ Number of objects of cls
+        """
+
+    @abstractmethod
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of cls whose attributes have the given values
+        """
+
+    @abstractmethod
+    def iter_all(self, cls: type) -> Iterator[TypeVar('Base')]:
+        """ Yield every object of cls
+        """
+
+    @abstractmethod
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Up to limit objects of cls in ID order, after that ID
+        """
+
+    @abstractmethod
+    def query(self, query: Query, explain: bool = False):
+        """ Iterator over the results of query, or its plan with explain
+        """
+
+    def flush(self):
+        """ Write every change still queued, a no-op for a storage that
+        writes changes at once
+        """
@@ -9,6 +9,11 @@ class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    indexed_attributes = ('email',)
+    unique_attributes = ('email',)
+    interned_attributes = ('first_name', 'last_name')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """